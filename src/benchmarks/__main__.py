@@ -0,0 +1,3 @@
+from benchmarks.stages import main
+
+main()
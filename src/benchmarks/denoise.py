@@ -0,0 +1,45 @@
+"""
+Compare the denoising backends of the enhancement node against `scipy.signal.medfilt`.
+
+Usage (from `src`):
+
+    python -m benchmarks.denoise [--shape 182 218 182] [--kernel-sizes 3 5] [--num-threads 4]
+
+Exits non-zero if a backend does not reproduce `medfilt` exactly.
+"""
+import argparse
+
+import numpy as np
+
+from benchmarks.measure import measure, report
+from benchmarks.phantom import MNI_1MM_SHAPE, make_phantom
+from node.enhancement.utils import denoise
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--shape', type=int, nargs=3, default=MNI_1MM_SHAPE)
+    parser.add_argument('--kernel-sizes', type=int, nargs='+', default=[3, 5])
+    parser.add_argument('--num-threads', type=int, default=1)
+    args = parser.parse_args()
+
+    # N4 hands float32 volumes to the enhancement stage
+    volume = make_phantom(tuple(args.shape)).astype(np.float32)
+
+    mismatches = []
+    for kernel_size in args.kernel_sizes:
+        expected, elapsed, peak = measure(denoise, volume, kernel_size, 'medfilt')
+        report(f'[k={kernel_size}] medfilt', elapsed, peak, volume.size)
+
+        for method in ('ndimage', 'chunked'):
+            denoised, elapsed, peak = measure(denoise, volume, kernel_size, method, args.num_threads)
+            report(f'[k={kernel_size}] {method}', elapsed, peak, volume.size)
+            if not np.array_equal(expected, denoised):
+                mismatches.append(f'{method} (k={kernel_size})')
+
+    if mismatches:
+        raise SystemExit('Denoised volume differs from medfilt for: ' + ', '.join(mismatches))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+"""
+Compare the fused enhance+segment node with the enhancement and segmentation nodes.
+
+Usage (from `src`):
+
+    python -m benchmarks.enhance_segment [--shape 182 218 182] [--kernel-size 3]
+
+Runs `EnhancementInterface` followed by `SegmentationInterface`, then
+`EnhanceSegmentInterface` on the same skull-stripped phantom, and checks
+that both write the same tissue maps and label volume.
+"""
+import argparse
+import tempfile
+from pathlib import Path
+
+import numpy as np
+
+from benchmarks.measure import measure, report
+from benchmarks.phantom import MNI_1MM_SHAPE, make_phantom, write_phantom
+from node.enhance_segment.interface import EnhanceSegmentInterface
+from node.enhancement.interface import EnhancementInterface
+from node.segmentation.interface import SegmentationInterface
+from utils.load_nii import load_nii
+
+OUTPUTS = ('gm_segmented_output_file', 'wm_segmented_output_file', 'csf_segmented_output_file', 'gm_labels_output_file')
+
+
+def two_nodes(input_file:Path, output_folder:Path, kernel_size:int):
+    enhanced = EnhancementInterface(kernel_size=kernel_size).run(input_file=input_file.as_posix(), output_folder=output_folder.as_posix())
+    return SegmentationInterface().run(input_file=enhanced.outputs.output_file, output_folder=output_folder.as_posix())
+
+
+def fused(input_file:Path, output_folder:Path, kernel_size:int):
+    return EnhanceSegmentInterface(kernel_size=kernel_size).run(input_file=input_file.as_posix(), output_folder=output_folder.as_posix())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--shape', type=int, nargs=3, default=list(MNI_1MM_SHAPE))
+    parser.add_argument('--kernel-size', type=int, default=3)
+    args = parser.parse_args()
+
+    shape = tuple(args.shape)
+    # Skull-stripped, bias-corrected scan as written by N4
+    volume = make_phantom(shape, bins_num=1024).astype(np.float32)
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        input_file = write_phantom(Path(temp_dir) / 'phantom_brain_corrected.nii.gz', volume)
+
+        results = {}
+        for name, func in (('enhancement + segmentation nodes', two_nodes), ('enhance_segment node', fused)):
+            output_folder = Path(temp_dir) / name.replace(' ', '_')
+            output_folder.mkdir()
+            result, elapsed, peak = measure(func, input_file, output_folder, args.kernel_size)
+            report(name, elapsed, peak, volume.size)
+            results[name] = result.outputs
+
+        reference, candidate = results.values()
+        for output in OUTPUTS:
+            expected, _ = load_nii(getattr(reference, output))
+            actual, _ = load_nii(getattr(candidate, output))
+            if expected.dtype != actual.dtype or not np.array_equal(expected, actual):
+                raise SystemExit(f'{output} differs between the fused and the separate nodes')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+"""
+Compare the fused intensity enhancement with the previous functions.
+
+Usage (from `src`):
+
+    python -m benchmarks.enhancement [--shape 182 218 182] [--seeds 42 7]
+
+Runs `enhance_intensity` and the previous `rescale_intensity` +
+`equalize_hist` on noisy phantoms in float32 (what N4 writes), float64
+and int16, with several `bins_num`, with and without equalization, and
+exits non-zero if any output voxel differs. Without bins, the output is
+float32 by design, so the previous output is compared once cast to it.
+"""
+import argparse
+
+import numpy as np
+
+from benchmarks.measure import measure, report
+from benchmarks.phantom import MNI_1MM_SHAPE, make_phantom
+from node.enhancement.utils import enhance_intensity
+
+DTYPES = (np.float32, np.float64, np.int16)
+
+
+def previous_rescale_intensity(volume:np.ndarray, percentils=[0.5, 99.5], bins_num=256) -> np.ndarray:
+    obj_volume = volume[np.where(volume > 0)]
+    min_value = np.percentile(obj_volume, percentils[0])
+    max_value = np.percentile(obj_volume, percentils[1])
+
+    if bins_num == 0:
+        obj_volume = (obj_volume - min_value) / (max_value - min_value).astype(np.float32)
+    else:
+        obj_volume = np.round((obj_volume - min_value) / (max_value - min_value) * (bins_num - 1))
+        obj_volume[np.where(obj_volume < 1)] = 1
+        obj_volume[np.where(obj_volume > (bins_num - 1))] = bins_num - 1
+
+    volume = volume.astype(obj_volume.dtype)
+    volume[np.where(volume > 0)] = obj_volume
+
+    return volume
+
+
+def previous_equalize_hist(volume:np.ndarray, bins_num=256) -> np.ndarray:
+    obj_volume = volume[np.where(volume > 0)]
+    hist, bins = np.histogram(obj_volume, bins_num)
+    cdf = hist.cumsum()
+    cdf = (bins_num - 1) * cdf / cdf[-1]
+
+    obj_volume = np.round(np.interp(obj_volume, bins[:-1], cdf)).astype(obj_volume.dtype)
+    volume[np.where(volume > 0)] = obj_volume
+    return volume
+
+
+def previous_enhance(volume:np.ndarray, bins_num:int, eh:bool) -> np.ndarray:
+    volume = previous_rescale_intensity(volume.copy(), [0.5, 99.5], bins_num)
+    if eh:
+        volume = previous_equalize_hist(volume, bins_num)
+    return volume
+
+
+def make_volume(shape, seed:int, dtype) -> np.ndarray:
+    # Phantom with continuous intensities, as the bias field correction leaves them
+    rng = np.random.default_rng(seed)
+    volume = make_phantom(shape, bins_num=1024, seed=seed)
+    brain = volume > 0
+    volume[brain] = np.maximum(volume[brain] * rng.gamma(20, 1 / 20, int(brain.sum())), 1)
+    return volume.astype(dtype)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--shape', type=int, nargs=3, default=list(MNI_1MM_SHAPE))
+    parser.add_argument('--seeds', type=int, nargs='+', default=[42, 7])
+    parser.add_argument('--bins', type=int, nargs='+', default=[0, 64, 256, 1000])
+    args = parser.parse_args()
+
+    mismatches = []
+    for seed in args.seeds:
+        for dtype in DTYPES:
+            volume = make_volume(tuple(args.shape), seed, dtype)
+            for bins_num in args.bins:
+                for eh in ((False, True) if bins_num > 0 else (False,)):
+                    name = f'[seed {seed}] {np.dtype(dtype).name} bins={bins_num} eh={eh}'
+                    expected, elapsed, peak = measure(previous_enhance, volume, bins_num, eh)
+                    report(f'{name} previous', elapsed, peak, volume.size)
+                    actual, elapsed, peak = measure(enhance_intensity, volume.copy(), [0.5, 99.5], bins_num, eh)
+                    report(f'{name} fused', elapsed, peak, volume.size)
+
+                    if bins_num == 0:
+                        expected = expected.astype(np.float32)
+                    different = int(np.count_nonzero(expected != actual))
+                    if different:
+                        mismatches.append(f'{name} ({different} voxels)')
+
+    if mismatches:
+        raise SystemExit('Enhanced volume differs from the previous functions for: ' + ', '.join(mismatches))
+
+
+if __name__ == '__main__':
+    main()
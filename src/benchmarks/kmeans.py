@@ -0,0 +1,140 @@
+"""
+Compare the K-means engines of the segmentation node.
+
+Usage (from `src`):
+
+    python -m benchmarks.kmeans [--shape 182 218 182] [--seeds 42 7 123]
+
+A quick check, e.g. before a commit touching the segmentation:
+
+    python -m benchmarks.kmeans --shape 91 109 91 --mixtures 10
+
+Every engine is timed on phantoms enhanced as the pipeline does, with
+`--bins` of 256 and a coarse 26 that leaves a few discrete levels, then on `--mixtures` random 3-Gaussian uint8 samples with skewed
+weights, means and widths.
+
+Each result is checked against the default `sklearn` engine. The
+`histogram` engine is exact, so its inertia must never exceed sklearn's,
+and its partition must be sklearn's whenever both reach the same inertia.
+Cluster numbering is arbitrary, so partitions are compared up to a
+permutation of the labels. sklearn may stop in a local optimum of higher
+inertia, where the partitions differ: this is reported, not a failure.
+The command exits non-zero on any failure.
+"""
+import argparse
+from typing import Optional
+
+from loguru import logger
+import numpy as np
+
+from benchmarks.enhancement import make_volume
+from benchmarks.measure import measure, report
+from benchmarks.phantom import MNI_1MM_SHAPE
+from node.enhancement.utils import enhance_intensity
+from node.segmentation.utils import KMEANS_ENGINES
+
+
+def same_partition(labels_a:np.ndarray, labels_b:np.ndarray) -> bool:
+    # Every label of `a` must map onto exactly one label of `b`, and vice versa
+    a = labels_a.astype(np.intp).ravel()
+    b = labels_b.astype(np.intp).ravel()
+    n_a, n_b = a.max() + 1, b.max() + 1
+    contingency = np.bincount(a * n_b + b, minlength=n_a * n_b).reshape((n_a, n_b))
+    nonzero = contingency > 0
+    return bool(np.all(nonzero.sum(axis=0) <= 1) and np.all(nonzero.sum(axis=1) <= 1))
+
+
+def inertia(intensities:np.ndarray, labels:np.ndarray) -> float:
+    # Sum of squared distances of the samples to the mean of their cluster
+    labels = labels.astype(np.intp)
+    counts = np.bincount(labels)
+    means = np.bincount(labels, weights=intensities) / np.maximum(counts, 1)
+    return float(np.sum((intensities - means[labels]) ** 2))
+
+
+def make_mixture(rng:np.random.Generator, n_samples:int) -> np.ndarray:
+    # Skewed 3-Gaussian mixture quantized to 1..255, as the enhancement stage leaves intensities
+    weights = rng.dirichlet(np.full(3, 0.7))
+    means = rng.uniform(20, 235, size=3)
+    stds = rng.uniform(3, 40, size=3)
+    component = rng.choice(3, size=n_samples, p=weights)
+    samples = rng.normal(means[component], stds[component])
+    return np.clip(np.round(samples), 1, 255).astype(np.uint8)
+
+
+def check_engine(name:str, intensities:np.ndarray, reference:np.ndarray, labels:np.ndarray) -> Optional[str]:
+    """
+    Compare a partition with the `sklearn` one, returning the failure if any.
+
+    Returns None when the partition is sklearn's, or has a lower inertia.
+    """
+    reference_inertia = inertia(intensities, reference)
+    engine_inertia = inertia(intensities, labels)
+    tolerance = 1e-9 * reference_inertia
+    if engine_inertia > reference_inertia + tolerance:
+        return f'{name}: inertia {engine_inertia:.6g} > sklearn {reference_inertia:.6g}'
+    if engine_inertia < reference_inertia - tolerance:
+        logger.info(f'{name}: sklearn stops at inertia {reference_inertia:.6g}, {engine_inertia:.6g} for this engine '
+                    f'({100 * (reference_inertia / engine_inertia - 1):.2f}% higher), partitions differ')
+        return None
+    if not same_partition(reference, labels):
+        return f'{name}: partition differs at the same inertia'
+    return None
+
+
+def compare_phantoms(shape, seeds:list, bins:list, n_clusters:int) -> list:
+    failures = []
+    for seed in seeds:
+        for bins_num in bins:
+            # Continuous phantom, enhanced to `bins_num` levels as the enhancement node does
+            volume = enhance_intensity(make_volume(shape, seed, np.float32), [0.5, 99.5], bins_num, True)
+            intensities = volume[volume > 0].astype(np.float64)
+            name = f'[seed {seed}] {len(np.unique(intensities))} levels'
+
+            reference, elapsed, peak = measure(KMEANS_ENGINES['sklearn'], intensities, n_clusters)
+            report(f'{name} sklearn', elapsed, peak, volume.size)
+            for engine in KMEANS_ENGINES:
+                if engine == 'sklearn':
+                    continue
+                labels, elapsed, peak = measure(KMEANS_ENGINES[engine], intensities, n_clusters)
+                report(f'{name} {engine}', elapsed, peak, volume.size)
+                failure = check_engine(f'{name} {engine}', intensities, reference, labels)
+                if failure:
+                    failures.append(failure)
+    return failures
+
+
+def compare_mixtures(n_mixtures:int, n_samples:int, n_clusters:int, seed:int) -> list:
+    rng = np.random.default_rng(seed)
+    failures = []
+    for i in range(n_mixtures):
+        intensities = make_mixture(rng, n_samples).astype(np.float64)
+        reference = KMEANS_ENGINES['sklearn'](intensities, n_clusters)
+        for engine in KMEANS_ENGINES:
+            if engine == 'sklearn':
+                continue
+            failure = check_engine(f'[mixture {i}] {engine}', intensities, reference, KMEANS_ENGINES[engine](intensities, n_clusters))
+            if failure:
+                failures.append(failure)
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--shape', type=int, nargs=3, default=MNI_1MM_SHAPE)
+    parser.add_argument('--seeds', type=int, nargs='+', default=[42])
+    parser.add_argument('--bins', type=int, nargs='+', default=[256, 26], help='`bins_num` of the enhancement of the phantoms')
+    parser.add_argument('--n-clusters', type=int, default=3)
+    parser.add_argument('--mixtures', type=int, default=30, help='Random skewed mixtures compared with sklearn')
+    parser.add_argument('--mixture-samples', type=int, default=200_000)
+    args = parser.parse_args()
+
+    failures = compare_phantoms(tuple(args.shape), args.seeds, args.bins, args.n_clusters)
+    failures += compare_mixtures(args.mixtures, args.mixture_samples, args.n_clusters, args.seeds[0])
+
+    if failures:
+        raise SystemExit('K-means engines disagree with sklearn: ' + '; '.join(failures))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+"""
+Compare the enhancement and segmentation nodes with and without the brain mask.
+
+Usage (from `src`):
+
+    python -m benchmarks.mask_index [--shape 182 218 182] [--kernel-sizes 1 3]
+
+Runs `EnhancementInterface` followed by `SegmentationInterface`, and
+`EnhanceSegmentInterface`, on the same skull-stripped phantom, first
+without a mask (the foreground is found with `volume > 0` over the whole
+grid), then with a BET-like mask slightly larger than the brain, and
+checks that both write the same images. With a median filter wider than
+one voxel, the mask is dilated by the kernel before being searched.
+"""
+import argparse
+import tempfile
+from pathlib import Path
+
+import numpy as np
+from scipy import ndimage
+
+from benchmarks.measure import measure, report
+from benchmarks.phantom import MNI_1MM_SHAPE, make_phantom, write_phantom
+from node.enhance_segment.interface import EnhanceSegmentInterface
+from node.enhancement.interface import EnhancementInterface
+from node.segmentation.interface import SegmentationInterface
+from utils.load_nii import load_nii
+
+OUTPUTS = ('gm_segmented_output_file', 'wm_segmented_output_file', 'csf_segmented_output_file', 'gm_labels_output_file')
+
+
+def two_nodes(input_file:Path, output_folder:Path, kernel_size:int, mask_file:dict):
+    enhanced = EnhancementInterface(kernel_size=kernel_size).run(input_file=input_file.as_posix(), output_folder=output_folder.as_posix(), **mask_file)
+    # The enhancement node passes on the mask bounding the enhanced image (dilated by the kernel)
+    mask_file = {'mask_file': enhanced.outputs.mask_file} if enhanced.outputs.mask_file else {}
+    segmented = SegmentationInterface().run(input_file=enhanced.outputs.output_file, output_folder=output_folder.as_posix(), **mask_file)
+    return enhanced.outputs.output_file, segmented
+
+
+def fused(input_file:Path, output_folder:Path, kernel_size:int, mask_file:dict):
+    segmented = EnhanceSegmentInterface(kernel_size=kernel_size, save_intermediate=True).run(
+        input_file=input_file.as_posix(), output_folder=output_folder.as_posix(), **mask_file
+    )
+    return segmented.outputs.enhanced_output_file, segmented
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--shape', type=int, nargs=3, default=list(MNI_1MM_SHAPE))
+    parser.add_argument('--kernel-sizes', type=int, nargs='+', default=[1, 3])
+    args = parser.parse_args()
+
+    shape = tuple(args.shape)
+    # Skull-stripped, bias-corrected scan as written by N4
+    volume = make_phantom(shape, bins_num=1024).astype(np.float32)
+    # BET's mask covers the brain and a little more
+    mask = ndimage.binary_dilation(volume > 0, iterations=2).astype(np.uint8)
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        input_file = write_phantom(Path(temp_dir) / 'phantom_brain_corrected.nii.gz', volume)
+        mask_file = write_phantom(Path(temp_dir) / 'phantom_brain_mask.nii.gz', mask)
+
+        for kernel_size in args.kernel_sizes:
+            for name, func in (('enhancement + segmentation nodes', two_nodes), ('enhance_segment node', fused)):
+                results = {}
+                for variant, inputs in (('without mask', {}), ('with mask', {'mask_file': mask_file.as_posix()})):
+                    output_folder = Path(temp_dir) / f'{name} {variant} k{kernel_size}'.replace(' ', '_')
+                    output_folder.mkdir()
+                    (enhanced_file, result), elapsed, peak = measure(func, input_file, output_folder, kernel_size, inputs)
+                    report(f'{name}, {variant}, kernel {kernel_size}', elapsed, peak, volume.size)
+                    results[variant] = [enhanced_file] + [getattr(result.outputs, output) for output in OUTPUTS]
+
+                for expected_file, actual_file in zip(*results.values()):
+                    expected, _ = load_nii(expected_file)
+                    actual, _ = load_nii(actual_file)
+                    if expected.dtype != actual.dtype or not np.array_equal(expected, actual):
+                        raise SystemExit(f'{Path(actual_file).name} of the {name} differs with the mask (kernel {kernel_size})')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,29 @@
+import time
+import tracemalloc
+from typing import Any, Callable, Tuple
+
+from loguru import logger
+
+
+def measure(func:Callable, *args, **kwargs) -> Tuple[Any, float, int]:
+    """
+    Run `func` once and return its result, wall time (s) and peak traced memory (bytes).
+
+    NumPy reports its buffers to `tracemalloc`, so the peak covers both
+    Python objects and arrays allocated during the call.
+    """
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    start = time.perf_counter()
+    try:
+        result = func(*args, **kwargs)
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def report(name:str, elapsed:float, peak:int, voxels:int=0):
+    throughput = f', {voxels / elapsed / 1e6:8.2f} Mvox/s' if voxels and elapsed > 0 else ''
+    logger.info(f'{name:<40} {elapsed:8.3f} s, peak {peak / 2 ** 20:9.1f} MiB{throughput}')
@@ -0,0 +1,55 @@
+from pathlib import Path
+from typing import Tuple
+
+import nibabel as nib
+import numpy as np
+
+# Shape of the MNI152 1mm template every subject is registered to
+MNI_1MM_SHAPE = (182, 218, 182)
+
+
+def make_phantom(shape:Tuple[int, int, int]=MNI_1MM_SHAPE, bins_num:int=256, seed:int=42) -> np.ndarray:
+    """
+    Build a synthetic brain-like volume with CSF, GM and WM shells.
+
+    The head is an ellipsoid filling ~80% of the field of view; voxels
+    outside it are 0, as after skull stripping. Intensities are quantized
+    to 1..bins_num-1 the same way `EnhancementInterface` leaves them.
+
+    Args:
+    shape (tuple): Volume shape.
+    bins_num (int): Number of intensity levels.
+    seed (int): Seed of the noise generator.
+    """
+    rng = np.random.default_rng(seed)
+
+    # Normalized ellipsoidal radius of every voxel (0 at the center, 1 at the surface)
+    axes = [np.linspace(-1.25, 1.25, n, dtype=np.float32) for n in shape]
+    x, y, z = np.meshgrid(*axes, indexing='ij', sparse=True)
+    radius = np.sqrt(x ** 2 + y ** 2 + z ** 2)
+
+    volume = np.zeros(shape, dtype=np.float64)
+    top = bins_num - 1
+    # (outer radius, mean intensity) from the outside in: CSF, GM, WM
+    for outer, mean in ((1.0, 0.2 * top), (0.9, 0.5 * top), (0.6, 0.8 * top)):
+        volume[radius <= outer] = mean
+
+    brain = volume > 0
+    volume[brain] += rng.normal(0, 0.06 * top, size=int(brain.sum()))
+    volume[brain] = np.clip(np.round(volume[brain]), 1, top)
+    return volume
+
+
+def write_phantom(path:str, volume:np.ndarray, dtype=None) -> Path:
+    """
+    Save a phantom as a NIfTI file with a 1mm isotropic, centered affine.
+
+    Args:
+    path (str): Output path (.nii or .nii.gz).
+    volume (np.ndarray): Volume, e.g. from `make_phantom`.
+    dtype (np.dtype): On-disk data type, defaults to the dtype of `volume`.
+    """
+    affine = np.eye(4)
+    affine[:3, 3] = -(np.array(volume.shape) - 1) / 2
+    nib.save(nib.Nifti1Image(volume, affine, dtype=dtype or volume.dtype), path)
+    return Path(path)
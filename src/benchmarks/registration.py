@@ -0,0 +1,84 @@
+"""
+Compare the `accurate` and `fast` registration profiles of FLIRTInterface.
+
+Usage (from `src`, needs FSL):
+
+    python -m benchmarks.registration /output/*/orient2std/*.nii.gz
+
+Registers every image with both profiles, without the transform cache,
+and reports their runtime, the similarity of each output to the MNI
+template (correlation and normalized mutual information) and how far the
+fast transform is from the accurate one (RMS displacement over an 80 mm
+sphere, Jenkinson 1999).
+"""
+import argparse
+import shutil
+import tempfile
+from pathlib import Path
+
+import numpy as np
+from loguru import logger
+
+from benchmarks.measure import measure, report
+from node.registration.interface import FLIRTInterface, REF_NII_TEMPLATE
+from utils.load_nii import load_nii
+
+
+def correlation(a:np.ndarray, b:np.ndarray) -> float:
+    return float(np.corrcoef(a.ravel(), b.ravel())[0, 1])
+
+
+def normalized_mutual_information(a:np.ndarray, b:np.ndarray, bins:int=64) -> float:
+    # (H(a) + H(b)) / H(a, b), 1 for independent images and 2 for identical ones
+    joint, _, _ = np.histogram2d(a.ravel(), b.ravel(), bins=bins)
+    joint /= joint.sum()
+
+    def entropy(p):
+        p = p[p > 0]
+        return -np.sum(p * np.log(p))
+
+    return float((entropy(joint.sum(axis=0)) + entropy(joint.sum(axis=1))) / entropy(joint))
+
+
+def rms_deviation(matrix_a:np.ndarray, matrix_b:np.ndarray, center:np.ndarray, radius:float=80.0) -> float:
+    """
+    RMS displacement (mm) between two affine transforms over a sphere of `radius` mm around `center`.
+    """
+    delta = matrix_a @ np.linalg.inv(matrix_b) - np.eye(4)
+    linear, translation = delta[:3, :3], delta[:3, 3] + delta[:3, :3] @ center
+    return float(np.sqrt(radius ** 2 / 5 * np.trace(linear.T @ linear) + translation @ translation))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('input_files', type=Path, nargs='+', help='Reoriented images, e.g. the outputs of the orient2std node')
+    args = parser.parse_args()
+
+    if shutil.which('flirt') is None:
+        raise SystemExit('FLIRT not found, this benchmark needs FSL')
+
+    reference, ref_affine = load_nii(REF_NII_TEMPLATE, dtype=np.float32)
+    # Center of the template in FSL's scaled voxel coordinates
+    center = (np.array(reference.shape) - 1) / 2 * np.abs(np.diag(ref_affine)[:3])
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for input_file in args.input_files:
+            logger.info(f'Registering: {input_file}')
+            matrices = {}
+            for profile in ('accurate', 'fast'):
+                output_folder = Path(temp_dir) / input_file.name / profile
+                result, elapsed, _ = measure(
+                    FLIRTInterface(profile=profile).run, input_file=input_file.as_posix(), output_folder=output_folder.as_posix()
+                )
+                registered, _ = load_nii(result.outputs.output_file, dtype=np.float32)
+                matrices[profile] = np.loadtxt(result.outputs.output_matrix_file)
+                report(f'{profile}', elapsed, result.runtime.stage_metrics['peak_rss_mb'] * 2 ** 20)
+                logger.info(
+                    f'{profile}: correlation to MNI {correlation(registered, reference):.4f}, '
+                    f'NMI to MNI {normalized_mutual_information(registered, reference):.4f}'
+                )
+            logger.info(f'RMS deviation of the fast transform: {rms_deviation(matrices["fast"], matrices["accurate"], center):.3f} mm')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+"""
+Benchmark the segmentation core around the K-means fit.
+
+Usage (from `src`):
+
+    python -m benchmarks.segmentation [--shape 182 218 182]
+
+Covers the feature extraction and label scatter of `kmeans_cluster`
+(with the fit replaced by a fixed intensity threshold) and the tissue
+maps built by `get_target_labels` + `segment_tissues`, each against the
+previous per-voxel / per-label implementation.
+"""
+import argparse
+
+import numpy as np
+
+from benchmarks.measure import measure, report
+from benchmarks.phantom import MNI_1MM_SHAPE, make_phantom
+from node.segmentation.utils import extract_features
+from node.segmentation.utils import get_target_labels
+from node.segmentation.utils import segment_tissues
+
+
+def _fake_labels(intensities:np.ndarray) -> np.ndarray:
+    return np.digitize(intensities, [85, 170])
+
+
+def loop_cluster(data:np.ndarray) -> np.ndarray:
+    # Previous per-voxel implementation
+    x_idx, y_idx, z_idx = np.where(data > 0)
+    features = []
+    for x, y, z in zip(x_idx, y_idx, z_idx):
+        features.append([data[x, y, z], x, y, z])
+    features = np.array(features)
+    model_labels = _fake_labels(features[..., 0])
+
+    labels = np.zeros(data.shape)
+    for l, f in zip(model_labels, features):
+        labels[int(f[1]), int(f[2]), int(f[3])] = l + 1
+    return labels
+
+
+def vectorized_cluster(data:np.ndarray) -> np.ndarray:
+    mask = data > 0
+    model_labels = _fake_labels(data[mask])
+
+    labels = np.zeros(data.shape)
+    labels[mask] = model_labels + 1
+    return labels
+
+
+def masked_tissue_maps(labels:np.ndarray, data:np.ndarray) -> list:
+    # Previous implementation: one full-volume mask per label and two per tissue
+    labels_set = np.unique(labels)
+    mean_intensities = []
+    for label in labels_set[1:]:
+        mean_intensities.append(np.mean(data[np.where(labels == label)]))
+    targets = [
+        mean_intensities.index(np.median(mean_intensities)) + 1,
+        mean_intensities.index(np.max(mean_intensities)) + 1,
+        mean_intensities.index(np.min(mean_intensities)) + 1,
+    ]
+    maps = []
+    for target in targets:
+        mask = np.copy(labels).astype(np.float32)
+        mask[np.where(mask != target)] = 0.333
+        mask[np.where(mask == target)] = 1.
+        maps.append(np.multiply(data.astype(np.float32), mask))
+    return maps
+
+
+def lookup_tissue_maps(labels:np.ndarray, data:np.ndarray) -> list:
+    targets = get_target_labels(labels.astype(np.uint8), data)
+    # Keep every map, like the previous implementation, for a fair comparison
+    return list(segment_tissues(labels.astype(np.uint8), data, targets))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--shape', type=int, nargs=3, default=MNI_1MM_SHAPE)
+    args = parser.parse_args()
+
+    data = make_phantom(tuple(args.shape))
+    voxels = data.size
+
+    _, elapsed, peak = measure(extract_features, data)
+    report('extract_features', elapsed, peak, voxels)
+
+    expected, elapsed, peak = measure(loop_cluster, data)
+    report('cluster + scatter (per-voxel loop)', elapsed, peak, voxels)
+
+    labels, elapsed, peak = measure(vectorized_cluster, data)
+    report('cluster + scatter (vectorized)', elapsed, peak, voxels)
+
+    if not np.array_equal(expected, labels):
+        raise SystemExit('Vectorized labels differ from the per-voxel loop')
+
+    expected, elapsed, peak = measure(masked_tissue_maps, labels, data)
+    report('tissue maps (per-label masks)', elapsed, peak, voxels)
+
+    maps, elapsed, peak = measure(lookup_tissue_maps, labels, data)
+    report('tissue maps (bincount + lookup table)', elapsed, peak, voxels)
+
+    if not all(np.array_equal(a, b) for a, b in zip(expected, maps)):
+        raise SystemExit('Lookup-table tissue maps differ from the per-label masks')
+
+
+if __name__ == '__main__':
+    main()
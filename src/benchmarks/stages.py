@@ -0,0 +1,149 @@
+"""
+Benchmark the pure-Python stages of the pipeline on synthetic phantoms.
+
+Usage (from `src`):
+
+    python -m benchmarks [--shape 182 218 182] [--repeat 3] [--stages enhancement segmentation]
+                         [--json results.json]
+
+Writes brain-like NIfTI phantoms with nibabel and runs every stage on
+them the way its node does, without FSL/ANTs. Each stage is timed over
+`--repeat` runs (the best one is kept) and run once more under
+`tracemalloc` for its peak memory, then its throughput in voxels/s is
+reported.
+"""
+import argparse
+import json
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, Dict
+
+import numpy as np
+from loguru import logger
+
+from benchmarks.measure import measure, report
+from benchmarks.phantom import MNI_1MM_SHAPE, make_phantom, write_phantom
+from node.enhancement.utils import denoise
+from node.enhancement.utils import enhance_intensity
+from node.segmentation.utils import get_target_labels
+from node.segmentation.utils import kmeans_cluster
+from node.segmentation.utils import segment_tissues
+from node.zip.interface import ZipOutputInterface
+from utils.draw_segmentation import draw_segmentation
+from utils.draw_segmentation import draw_segmentations
+from utils.load_nii import load_nii
+from utils.save_nii import save_nii
+from utils.save_nii_as_png import save_nii_as_png
+from utils.save_nii_as_png import save_nii_mosaic_as_png
+
+
+def _enhancement(volume:np.ndarray) -> Callable:
+    def run():
+        denoised = denoise(volume, kernel_size=3)
+        return enhance_intensity(denoised, [0.5, 99.5], 256, True)
+    return run
+
+
+def _segmentation(volume:np.ndarray) -> Callable:
+    def run():
+        labels = kmeans_cluster(volume, 3)
+        return list(segment_tissues(labels, volume, get_target_labels(labels, volume)))
+    return run
+
+
+def _zip(input_file:Path, output_folder:Path, mode:str) -> Callable:
+    def run():
+        return ZipOutputInterface(mode=mode).run(input_file=input_file.as_posix(), output_folder=output_folder.as_posix())
+    return run
+
+
+def make_stages(shape, folder:Path) -> Dict[str, Callable]:
+    """
+    Write the phantoms of every stage in `folder` and return the stage runs by name.
+    """
+    # Raw scan: int16 with noise in the background, as read by acpcdetect
+    rng = np.random.default_rng(0)
+    raw = (make_phantom(shape, bins_num=1024) + rng.normal(20, 8, shape)).astype(np.int16)
+    raw_file = write_phantom(folder / 'raw.nii', raw)
+
+    # Skull-stripped, bias-corrected scan: float32 with a zero background
+    stripped = make_phantom(shape, bins_num=1024).astype(np.float32)
+    stripped[stripped > 0] += rng.normal(0, 2, int((stripped > 0).sum())).astype(np.float32)
+    # Enhanced scan: quantized to 256 levels
+    enhanced = make_phantom(shape)
+
+    # Tissue maps drawn on top of the raw scan, with the same affine so both images overlap
+    labels = kmeans_cluster(enhanced, 3)
+    _, affine = load_nii(raw_file.as_posix())
+    map_files = [folder / f'{tissue}.nii.gz' for tissue in ('gm', 'wm', 'csf')]
+    for map_file, tissue_map in zip(map_files, segment_tissues(labels, enhanced, get_target_labels(labels, enhanced))):
+        save_nii(tissue_map, map_file.as_posix(), affine)
+    map_pngs = [(folder / f'{map_file.name}.png').as_posix() for map_file in map_files]
+
+    output_folder = folder / 'output'
+    output_folder.mkdir()
+
+    return {
+        'enhancement': _enhancement(stripped),
+        'segmentation': _segmentation(enhanced),
+        'save_nii_as_png': lambda: save_nii_as_png(raw_file.as_posix(), (folder / 'raw.png').as_posix()),
+        'save_nii_mosaic_as_png': lambda: save_nii_mosaic_as_png(raw_file.as_posix(), (folder / 'raw_mosaic.png').as_posix()),
+        'draw_segmentation (3 maps)': lambda: [draw_segmentation(raw_file.as_posix(), map_file.as_posix(), map_png) for map_file, map_png in zip(map_files, map_pngs)],
+        'draw_segmentations (3 maps)': lambda: draw_segmentations(raw_file.as_posix(), map_files, map_pngs, ['GM', 'WM', 'CSF']),
+        'zip (gzip)': _zip(raw_file, output_folder, 'gzip'),
+        'zip (link)': _zip(raw_file, output_folder, 'link'),
+    }
+
+
+def bench(func:Callable, repeat:int=3) -> Dict[str, float]:
+    """
+    Best wall time of `repeat` runs of `func`, and its peak memory in one traced run.
+    """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    # tracemalloc slows down allocations, so the peak is measured separately
+    _, _, peak = measure(func)
+    return {'wall_time_s': min(timings), 'peak_bytes': peak}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--shape', type=int, nargs=3, default=list(MNI_1MM_SHAPE))
+    parser.add_argument('--repeat', type=int, default=3, help='Timed runs per stage, the best one is kept')
+    parser.add_argument('--stages', nargs='+', help='Stages to run (default: all)')
+    parser.add_argument('--json', type=Path, help='Write the results to this file')
+    args = parser.parse_args()
+
+    shape = tuple(args.shape)
+    voxels = int(np.prod(shape))
+    results = []
+    with tempfile.TemporaryDirectory() as temp_dir:
+        stages = make_stages(shape, Path(temp_dir))
+        unknown = set(args.stages or []) - set(stages)
+        if unknown:
+            parser.error(f'Unknown stages: {sorted(unknown)}, choose from {list(stages)}')
+
+        logger.info(f'Phantom shape: {shape} ({voxels / 1e6:.1f} Mvox)')
+        for name, func in stages.items():
+            if args.stages and name not in args.stages:
+                continue
+            result = bench(func, args.repeat)
+            report(name, result['wall_time_s'], result['peak_bytes'], voxels)
+            results.append({
+                'stage': name,
+                'shape': list(shape),
+                'voxels_per_s': voxels / result['wall_time_s'],
+                **result,
+            })
+
+    if args.json:
+        args.json.write_text(json.dumps(results, indent=2))
+        logger.info(f'Results written to {args.json}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+"""
+Measure the cold start of the pipeline: the imports of `workflow` and the CLI.
+
+Usage (from `src`):
+
+    python -m benchmarks.startup [--repeat 3] [--top 15]
+
+Imports `workflow` in fresh interpreters with `python -X importtime`,
+reports the best wall time and the slowest modules (cumulative time),
+then times `python -m preprocess run --help`. Fails when `workflow`
+imports one of the heavy packages that the nodes only import when they
+run (nilearn, matplotlib, scikit-learn, pydot).
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+from typing import Dict, List, Tuple
+
+from loguru import logger
+
+# Packages only imported by the nodes that use them, when they run
+DEFERRED_PACKAGES = ('nilearn', 'matplotlib', 'sklearn', 'pydot')
+
+
+def _environ() -> dict:
+    # The registration node reads the templates' folder when imported
+    return {**os.environ, 'FSLDIR': os.getenv('FSLDIR', '/usr/local/fsl')}
+
+
+def import_times(module:str) -> Tuple[float, Dict[str, int], List[str]]:
+    """
+    Import `module` in a fresh interpreter.
+
+    Returns the wall time (s), the cumulative import time (us) of every
+    module from `-X importtime`, and the top-level packages imported.
+    """
+    code = f'import sys, {module}; print(" ".join(sorted({{name.split(".")[0] for name in sys.modules}})))'
+    start = time.perf_counter()
+    process = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', code], capture_output=True, text=True, env=_environ(), check=True
+    )
+    elapsed = time.perf_counter() - start
+
+    cumulative = {}
+    for line in process.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, total, name = line[len('import time:'):].split('|')
+        cumulative[name.strip()] = int(total)
+    return elapsed, cumulative, process.stdout.split()
+
+
+def command_time(command:List[str]) -> float:
+    start = time.perf_counter()
+    subprocess.run(command, capture_output=True, env=_environ(), check=True)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--module', default='workflow', help='Module to import')
+    parser.add_argument('--repeat', type=int, default=3, help='Fresh interpreters per measure, the best one is kept')
+    parser.add_argument('--top', type=int, default=15, help='Slowest modules to report')
+    args = parser.parse_args()
+
+    runs = [import_times(args.module) for _ in range(args.repeat)]
+    elapsed, cumulative, packages = min(runs, key=lambda run: run[0])
+    logger.info(f'import {args.module}: {elapsed:.3f} s (interpreter included)')
+    for name, total in sorted(cumulative.items(), key=lambda item: -item[1])[:args.top]:
+        logger.info(f'{name:<50} {total / 1e6:8.3f} s')
+
+    help_time = min(command_time([sys.executable, '-m', 'preprocess', 'run', '--help']) for _ in range(args.repeat))
+    logger.info(f'python -m preprocess run --help: {help_time:.3f} s')
+
+    imported = sorted(set(DEFERRED_PACKAGES) & set(packages))
+    if imported:
+        raise SystemExit(f'import {args.module} loads {imported}, which should only be imported by the nodes using them')
+
+
+if __name__ == '__main__':
+    main()
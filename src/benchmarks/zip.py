@@ -0,0 +1,60 @@
+"""
+Time the ways the zip stage can hand the ACPC output to FSL.
+
+Usage (from `src`):
+
+    python -m benchmarks.zip [--shape 256 256 170] [--num-threads 4]
+
+Writes an uncompressed int16 phantom (the size of a raw ADNI T1), then
+compresses it at several levels / thread counts and links it, checking
+that nibabel reads back the same data.
+"""
+import argparse
+import os
+import tempfile
+from pathlib import Path
+
+import nibabel as nib
+import numpy as np
+
+from benchmarks.measure import measure, report
+from benchmarks.phantom import make_phantom
+from node.zip.utils import gzip_file, link_file
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--shape', type=int, nargs=3, default=[256, 256, 170])
+    parser.add_argument('--num-threads', type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    # Raw scans are int16 with noise in the background as well
+    rng = np.random.default_rng(0)
+    volume = (make_phantom(tuple(args.shape), bins_num=1024) + rng.normal(20, 8, args.shape)).astype(np.int16)
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        input_file = Path(temp_dir) / 'phantom_RAS.nii'
+        nib.save(nib.Nifti1Image(volume, np.eye(4)), input_file)
+        size = input_file.stat().st_size
+
+        runs = [
+            ('gzip level 9 (previous default)', dict(compress_level=9)),
+            ('gzip level 6', dict(compress_level=6)),
+            ('gzip level 1', dict(compress_level=1)),
+            (f'gzip level 6, {args.num_threads} threads', dict(compress_level=6, num_threads=args.num_threads)),
+        ]
+        for name, kwargs in runs:
+            output_file = Path(temp_dir) / 'phantom_RAS.nii.gz'
+            _, elapsed, peak = measure(gzip_file, input_file, output_file, **kwargs)
+            report(f'{name} ({output_file.stat().st_size / size:.0%})', elapsed, peak, volume.size)
+            if not np.array_equal(np.asanyarray(nib.load(output_file).dataobj), volume):
+                raise SystemExit(f'{name}: compressed file does not read back the same data')
+            output_file.unlink()
+
+        output_file = Path(temp_dir) / 'linked_RAS.nii'
+        _, elapsed, peak = measure(link_file, input_file, output_file)
+        report('link', elapsed, peak, volume.size)
+
+
+if __name__ == '__main__':
+    main()
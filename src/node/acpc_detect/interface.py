@@ -1,40 +1,52 @@
 from pathlib import Path
 
-from nipype.interfaces.base import SimpleInterface
 from nipype.interfaces.base import BaseInterfaceInputSpec
 from nipype.interfaces.base import TraitedSpec
 from nipype.interfaces.base import File
 from nipype.interfaces.base import Directory
+from nipype.interfaces.base import traits
+from nipype.interfaces.base import isdefined
+from node.instrumented_interface import InstrumentedInterface
 
 from node.acpc_detect.utils import acpc_detect
 
+from utils.nii_stem import nii_stem
 from utils.save_nii_as_png import save_nii_as_png
+from utils.save_nii_as_png import save_nii_mosaic_as_png
 
 class ACPCDetectInputSpec(BaseInterfaceInputSpec):
     input_file = File(exists=True, desc='Path to the NIfTI file', mandatory=True)
     output_folder = Directory(exists=True, desc='Path to the output folder', mandatory=False)
+    qc_mosaic = traits.Bool(False, usedefault=True, desc='Also save a mosaic of slices along the three axes for QC')
+    scratch_root = Directory(desc='Scratch folder acpcdetect runs in (e.g. /dev/shm), defaults to `ACPC_SCRATCH_ROOT` or the output folder')
 
 class ACPCDetectOutputSpec(TraitedSpec):
     output_file = File(exists=True, desc='Directory with the ACPC detection results', mandatory=True)
     output_png_file = File(exists=True, desc='Directory with the ACPC detection PNG image', mandatory=True)
+    output_mosaic_file = File(exists=True, desc='ACPC detection QC mosaic, only set with `qc_mosaic`')
 
-class ACPCDetectInterface(SimpleInterface):
+class ACPCDetectInterface(InstrumentedInterface):
     input_spec = ACPCDetectInputSpec
     output_spec = ACPCDetectOutputSpec
 
     def _run_interface(self, runtime):
         input_file = Path(self.inputs.input_file)
         output_folder = Path(self.inputs.output_folder)
-        new_output_folder = acpc_detect(input_file, output_folder)
+        scratch_root = self.inputs.scratch_root if isdefined(self.inputs.scratch_root) else None
+        new_output_folder = acpc_detect(input_file, output_folder, scratch_root)
         # Only one file is expected
-        output_file = new_output_folder / (Path(input_file).stem + '_RAS.nii')
-        output_png_file = new_output_folder / (Path(input_file).stem+ '_RAS.png')
+        output_file = new_output_folder / (nii_stem(input_file) + '_RAS.nii')
+        output_png_file = new_output_folder / (nii_stem(input_file) + '_RAS.png')
         save_nii_as_png(
             output_file,
             output_png_file
         )
         self._results['output_file'] = output_file.as_posix()
         self._results['output_png_file'] = output_png_file.as_posix()
+        if self.inputs.qc_mosaic:
+            output_mosaic_file = new_output_folder / (nii_stem(input_file) + '_RAS_mosaic.png')
+            save_nii_mosaic_as_png(output_file, output_mosaic_file)
+            self._results['output_mosaic_file'] = output_mosaic_file.as_posix()
         return runtime
 
     def _list_outputs(self):
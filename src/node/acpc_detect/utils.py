@@ -1,11 +1,14 @@
 from pathlib import Path
 
+import gzip
 import tempfile
 import shutil
-import subprocess
 import os
 from loguru import logger
 
+from utils.nii_stem import nii_stem
+from utils.command_runner import run_command
+
 
 # Set ART location
 os.environ['ARTHOME'] = '/utils/atra1.0_LinuxCentOS6.7/'
@@ -13,39 +16,72 @@ os.environ['ARTHOME'] = '/utils/atra1.0_LinuxCentOS6.7/'
 # ACPC detection executable path
 ACPC_DETECT_BIN_PATH = '/utils/acpcdetect_v2.1_LinuxCentOS6.7/bin/acpcdetect'
 
-
-def acpc_detect(nii_file_path: Path, output_path:Path) -> Path:
+# Scratch folder acpcdetect runs in, e.g. `/dev/shm`; defaults to the output folder of the subject
+ACPC_SCRATCH_ROOT = os.getenv('ACPC_SCRATCH_ROOT')
+
+
+def stage_input(nii_file_path:Path, staged_file_path:Path):
+    """
+    Make `nii_file_path` readable as the uncompressed `staged_file_path`, without copying it when possible.
+
+    acpcdetect only reads uncompressed NIfTI, so a `.nii.gz` is decompressed.
+    A `.nii` is hardlinked, or symlinked when the scratch folder is on
+    another filesystem (e.g. `/dev/shm`); acpcdetect only reads it.
+    """
+    if nii_file_path.name.endswith('.gz'):
+        with gzip.open(nii_file_path, 'rb') as f_in, open(staged_file_path, 'wb') as f_out:
+            shutil.copyfileobj(f_in, f_out)
+        return
+    try:
+        os.link(nii_file_path, staged_file_path)
+    except OSError:
+        staged_file_path.symlink_to(nii_file_path.resolve())
+
+
+def acpc_detect(nii_file_path: Path, output_path:Path, scratch_root:Path=None) -> Path:
+    """
+    Run acpcdetect on `nii_file_path` and move its outputs to `<output_path>/acpc`.
+
+    Args:
+    nii_file_path (Path): Input scan (.nii or .nii.gz).
+    output_path (Path): Output folder of the subject.
+    scratch_root (Path): Folder of the scratch directory acpcdetect runs in,
+        defaults to `ACPC_SCRATCH_ROOT` or `output_path` (same filesystem, so
+        the input is hardlinked and the outputs are renamed, not copied).
+    """
     logger.info('ACPC detection on: {}'.format(nii_file_path))
 
     # Specify the output folder
     output_folder = output_path / 'acpc'
     logger.info('ACPC Output path: {}'.format(output_folder))
 
-    # Use a temporary directory
-    with tempfile.TemporaryDirectory() as temp_dir:
+    scratch_root = Path(scratch_root or ACPC_SCRATCH_ROOT or output_path)
+    scratch_root.mkdir(parents=True, exist_ok=True)
+
+    # Use a temporary directory, acpcdetect writes its outputs next to its input
+    with tempfile.TemporaryDirectory(prefix='acpc-', dir=scratch_root) as temp_dir:
         temp_dir_path = Path(temp_dir)
 
-        # Copy the .nii file to the temporary directory
-        temp_nii_file_path = temp_dir_path / nii_file_path.name
-        shutil.copy(nii_file_path, temp_nii_file_path)
+        temp_nii_file_path = temp_dir_path / (nii_stem(nii_file_path) + '.nii')
+        stage_input(nii_file_path, temp_nii_file_path)
 
         # Modify the command to use the new .nii file path in the temporary directory
         command = [ACPC_DETECT_BIN_PATH, "-no-tilt-correction", "-center-AC", "-nopng", "-noppm", "-i", str(temp_nii_file_path)]
 
-        # Run the command
-        subprocess.call(command, stdout=open(os.devnull, "w"), stderr=subprocess.STDOUT)
+        # Run the command within the limits of acpcdetect (slots, timeout & retries)
+        run_command(command, 'acpcdetect')
 
         # Create a folder as the same name as the .nii file
         Path(output_folder).mkdir(parents=True, exist_ok=True)
 
         # Clean the folder
         for file in output_folder.glob('*'):
-            if file.is_file():
+            if file.is_file() or file.is_symlink():
                 file.unlink()
             if file.is_dir():
                 shutil.rmtree(file)
 
-        # Move the output files to the folder
+        # Move the output files to the folder, a rename when the scratch folder is on the same filesystem
         for file in temp_dir_path.glob('*'):
             #logger.info('Moving {} to {}'.format(file, output_folder))
             shutil.move(file, output_folder)
@@ -2,17 +2,27 @@ import shutil
 from pathlib import Path
 
 from loguru import logger
-from nipype.interfaces.base import (SimpleInterface, BaseInterfaceInputSpec, TraitedSpec, File, Directory)
+from nipype.interfaces.base import (BaseInterfaceInputSpec, TraitedSpec, File, Directory, isdefined, traits)
 from nipype.interfaces.ants import N4BiasFieldCorrection
+from node.instrumented_interface import InstrumentedInterface
+
+from utils.command_runner import run_nipype_command
+from utils.nii_stem import nii_stem
+
+from node.bias_field_correction.utils import N4_PROFILES
+from node.bias_field_correction.utils import write_foreground_mask
 
 class BiasFieldCorrectionInputSpec(BaseInterfaceInputSpec):
     input_file = File(exists=True, desc='Source image path (.nii.gz)', mandatory=True)
     output_folder = Directory(exists=False, desc='Output folder for the bias corrected image', mandatory=True)
+    mask_file = File(exists=True, desc='Brain mask the bias field is fitted on, defaults to the voxels > 0 of the input', mandatory=False)
+    profile = traits.Enum(*N4_PROFILES, usedefault=True, desc='`fast` uses a larger shrink factor and fewer iterations')
+    num_threads = traits.Int(1, usedefault=True, desc='Number of ITK threads, set from the node\'s n_procs')
 
 class BiasFieldCorrectionOutputSpec(TraitedSpec):
     output_file = File(exists=True, desc='Path to the bias corrected image')
 
-class BiasFieldCorrectionInterface(SimpleInterface):
+class BiasFieldCorrectionInterface(InstrumentedInterface):
     input_spec = BiasFieldCorrectionInputSpec
     output_spec = BiasFieldCorrectionOutputSpec
 
@@ -35,16 +45,27 @@ class BiasFieldCorrectionInterface(SimpleInterface):
             if file.is_dir():
                 shutil.rmtree(file)
 
+        # Fit the bias field on the brain only
+        mask_file = self.inputs.mask_file
+        if not isdefined(mask_file):
+            mask_file = output_bias_correction_folder / (nii_stem(input_file) + '_mask.nii.gz')
+            write_foreground_mask(input_file, str(mask_file))
+
+        profile = N4_PROFILES[self.inputs.profile]
+
         try:
             n4 = N4BiasFieldCorrection()
             n4.inputs.input_image = str(input_file)
             n4.inputs.output_image = str(output_file)
+            n4.inputs.mask_image = str(mask_file)
             n4.inputs.dimension = 3
-            n4.inputs.n_iterations = [100, 100, 60, 40]
-            n4.inputs.shrink_factor = 3
+            n4.inputs.n_iterations = profile['n_iterations']
+            n4.inputs.shrink_factor = profile['shrink_factor']
             n4.inputs.convergence_threshold = 1e-4
             n4.inputs.bspline_fitting_distance = 300
-            n4.run()
+            # Bound ITK's threads, instead of one per core in every MultiProc worker
+            n4.inputs.num_threads = self.inputs.num_threads
+            run_nipype_command(n4)
 
             self._results['output_file'] = str(output_file)
 
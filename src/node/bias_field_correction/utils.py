@@ -0,0 +1,21 @@
+import numpy as np
+
+from utils.load_nii import load_nii
+from utils.save_nii import save_nii
+
+# N4 settings per profile. `fast` fits the bias field on a coarser grid with fewer iterations
+N4_PROFILES = {
+    'accurate': {'n_iterations': [100, 100, 60, 40], 'shrink_factor': 3},
+    'fast': {'n_iterations': [50, 50, 30, 20], 'shrink_factor': 4},
+}
+
+def write_foreground_mask(input_file:str, mask_file:str):
+    """
+    Save the foreground (voxels > 0) of a skull-stripped image as a uint8 mask.
+
+    Args:
+    input_file (str): Skull-stripped image.
+    mask_file (str): Path of the mask.
+    """
+    volume, affine = load_nii(input_file)
+    save_nii(np.asarray(volume) > 0, mask_file, affine)
@@ -1,55 +1,66 @@
 import shutil
 from pathlib import Path
 
-from nipype.interfaces.base import (SimpleInterface, BaseInterfaceInputSpec, TraitedSpec, File, Directory, traits)
+from nipype.interfaces.base import (BaseInterfaceInputSpec, TraitedSpec, File, Directory, traits)
+from node.instrumented_interface import InstrumentedInterface
 from loguru import logger
 
-from utils.draw_segmentation import draw_segmentation
+from utils.draw_segmentation import draw_segmentations
 
-class DrawSegmentationInputSpec(BaseInterfaceInputSpec):
+class DrawSegmentationMapsInputSpec(BaseInterfaceInputSpec):
     acpc_input_file = File(exists=True, desc='ACPC aligned Source image path (.nii.gz or .nii)', mandatory=True)
-    segmented_input_file = File(exists=True, desc='Segmented Source image path (.nii.gz or .nii)', mandatory=True)
-    output_folder = Directory(exists=False, desc='Output folder for the segmented image', mandatory=True)
-    threshold = traits.Float(0.68, usedefault=True, desc='Threshold for the segmentation image (0-1)')
-    title = traits.String('prob-map', usedefault=True, desc='Title for the segmentation image')
-
-class DrawSegmentationOutputSpec(TraitedSpec):
-    output_file = File(exists=True, desc='Path to png image')
-
-class DrawSegmentationInterface(SimpleInterface):
-    input_spec = DrawSegmentationInputSpec
-    output_spec = DrawSegmentationOutputSpec
+    gm_segmented_input_file = File(exists=True, desc='GM segmented image path (.nii.gz or .nii)', mandatory=True)
+    wm_segmented_input_file = File(exists=True, desc='WM segmented image path (.nii.gz or .nii)', mandatory=True)
+    csf_segmented_input_file = File(exists=True, desc='CSF segmented image path (.nii.gz or .nii)', mandatory=True)
+    output_folder = Directory(exists=False, desc='Output folder for the segmented images', mandatory=True)
+    threshold = traits.Float(0.68, usedefault=True, desc='Threshold for the segmentation images (0-1)')
+    num_threads = traits.Int(1, usedefault=True, desc='Number of worker processes drawing the maps')
+
+class DrawSegmentationMapsOutputSpec(TraitedSpec):
+    gm_output_file = File(exists=True, desc='Path to GM png image')
+    wm_output_file = File(exists=True, desc='Path to WM png image')
+    csf_output_file = File(exists=True, desc='Path to CSF png image')
+
+class DrawSegmentationMapsInterface(InstrumentedInterface):
+    """
+    Draw the GM, WM and CSF maps on the ACPC image in one node, loading the image once.
+    """
+    input_spec = DrawSegmentationMapsInputSpec
+    output_spec = DrawSegmentationMapsOutputSpec
+
+    titles = {'gm': 'GM@map', 'wm': 'WM@map', 'csf': 'CSF@map'}
 
     def _run_interface(self, runtime):
-        title = self.inputs.title
-
         acpc_input_file = self.inputs.acpc_input_file
-        segmented_input_file = self.inputs.segmented_input_file
 
         output_folder = Path(self.inputs.output_folder)
         output_draw_folder = output_folder / 'draw_segmentation'
 
-        # Specify the output png path
-        output_png_path = output_draw_folder / f'{title}.png'
+        # Specify the output png paths
+        segmented_input_files = [getattr(self.inputs, f'{tissue}_segmented_input_file') for tissue in self.titles]
+        output_png_paths = [output_draw_folder / f'{title}.png' for title in self.titles.values()]
 
-        logger.info(f'Running draw segmentation for {segmented_input_file} to {output_png_path}')
+        logger.info(f'Running draw segmentation for {segmented_input_files} to {output_draw_folder}')
 
         # Ensure the output directory exists
         output_draw_folder.mkdir(parents=True, exist_ok=True)
 
-        # Clean up the output file if it already exists
-        if output_png_path.exists():
-            output_png_path.unlink()
+        # Clean up the output files if they already exist
+        for output_png_path in output_png_paths:
+            if output_png_path.exists():
+                output_png_path.unlink()
 
-        draw_segmentation(
+        draw_segmentations(
             input_nii_path=acpc_input_file,
-            input_seg_nii_path=segmented_input_file,
-            output_png_path=output_png_path.absolute().as_posix(),
+            input_seg_nii_paths=segmented_input_files,
+            output_png_paths=[output_png_path.absolute().as_posix() for output_png_path in output_png_paths],
+            titles=list(self.titles.values()),
             threshold=self.inputs.threshold,
-            title=title,
+            num_workers=self.inputs.num_threads,
         )
 
-        self._results['output_file'] = output_png_path.as_posix()
+        for tissue, output_png_path in zip(self.titles, output_png_paths):
+            self._results[f'{tissue}_output_file'] = output_png_path.as_posix()
 
         return runtime
 
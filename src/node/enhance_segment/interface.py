@@ -0,0 +1,70 @@
+import shutil
+from pathlib import Path
+
+import numpy as np
+
+from nipype.interfaces.base import (File, traits)
+from loguru import logger
+
+from utils.save_nii import save_nii
+from utils.load_nii import load_nii
+
+from node.enhancement.interface import EnhancementInputSpec
+from node.enhancement.utils import check_bins_num
+from node.enhancement.utils import denoise
+from node.enhancement.utils import enhance_intensity
+from node.enhancement.utils import foreground_mask_index
+from node.segmentation.interface import SegmentationInputSpec
+from node.segmentation.interface import SegmentationOutputSpec
+from node.segmentation.interface import SegmentationInterface
+
+class EnhanceSegmentInputSpec(EnhancementInputSpec, SegmentationInputSpec):
+    save_intermediate = traits.Bool(False, usedefault=True, desc='Also save the enhanced image in the `enhancement` folder')
+
+class EnhanceSegmentOutputSpec(SegmentationOutputSpec):
+    enhanced_output_file = File(desc='Path to the enhanced image, only set with `save_intermediate`')
+
+class EnhanceSegmentInterface(SegmentationInterface):
+    """
+    Enhancement and segmentation in one node.
+
+    The enhanced volume is handed to the segmentation in memory instead of
+    being written as a gzipped NIfTI and read back by the next node. The
+    outputs are the same as `EnhancementInterface` followed by
+    `SegmentationInterface` on the same input file.
+    """
+    input_spec = EnhanceSegmentInputSpec
+    output_spec = EnhanceSegmentOutputSpec
+
+    def _run_interface(self, runtime):
+        # Rejected before the input is loaded and denoised
+        check_bins_num(self.inputs.bins_num, self.inputs.eh)
+        return super()._run_interface(runtime)
+
+    def _load_volume(self, input_file:str, mask_index):
+        volume, affine = load_nii(input_file, dtype=np.float32)
+        volume = denoise(volume, self.inputs.kernel_size, self.inputs.denoise_method, self.inputs.num_threads, mask_index)
+        # The median filter can spread the brain past the edge of the mask, by up to its radius
+        mask_index = foreground_mask_index(mask_index, self.inputs.kernel_size, volume.shape)
+        # Rescaling and histogram equalization in one pass over the foreground
+        volume = enhance_intensity(volume, self.inputs.percentiles, self.inputs.bins_num, self.inputs.eh, mask_index)
+
+        if self.inputs.save_intermediate:
+            output_enhancement_folder = Path(self.inputs.output_folder) / 'enhancement'
+            enhanced_image_path = output_enhancement_folder / Path(input_file).name
+            logger.info(f'Output: {enhanced_image_path}')
+
+            # Ensure the output directory exists
+            output_enhancement_folder.mkdir(parents=True, exist_ok=True)
+
+            # Clean up the output directory
+            for file in output_enhancement_folder.glob('*'):
+                if file.is_file():
+                    file.unlink()
+                if file.is_dir():
+                    shutil.rmtree(file)
+
+            save_nii(volume, str(enhanced_image_path), affine)
+            self._results['enhanced_output_file'] = str(enhanced_image_path)
+
+        return volume, affine, mask_index
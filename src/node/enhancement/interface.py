@@ -1,28 +1,39 @@
 from pathlib import Path
 import shutil
 
-from nipype.interfaces.base import (SimpleInterface, BaseInterfaceInputSpec, TraitedSpec, File, traits)
+import numpy as np
+
+from nipype.interfaces.base import (BaseInterfaceInputSpec, TraitedSpec, File, traits, isdefined)
+from node.instrumented_interface import InstrumentedInterface
 from loguru import logger
 
+from utils.load_mask import load_mask
+from utils.load_mask import scatter
 from utils.load_nii import load_nii
+from utils.nii_stem import nii_stem
 from utils.save_nii import save_nii
 
+from node.enhancement.utils import check_bins_num
 from node.enhancement.utils import denoise
-from node.enhancement.utils import rescale_intensity
-from node.enhancement.utils import equalize_hist
+from node.enhancement.utils import enhance_intensity
+from node.enhancement.utils import foreground_mask_index
 
 class EnhancementInputSpec(BaseInterfaceInputSpec):
     input_file = File(exists=True, desc='Source image path (.nii.gz)', mandatory=True)
     output_folder = traits.Directory(exists=False, desc='Output folder for the enhanced image', mandatory=True)
     kernel_size = traits.Int(1, usedefault=True, desc='Kernel size for denoising. If the size is too large, the image will be blurred')
+    denoise_method = traits.Enum('chunked', 'ndimage', 'medfilt', usedefault=True, desc='Median filter backend (`medfilt` is the scipy.signal reference)')
+    num_threads = traits.Int(1, usedefault=True, desc='Number of threads for the `chunked` median filter')
     percentiles = traits.List([0.5, 99.5], usedefault=True, desc='Percentiles for intensity rescaling')
     bins_num = traits.Int(256, usedefault=True, desc='Number of bins for histogram equalization')
     eh = traits.Bool(True, usedefault=True, desc='Enable histogram equalization')
+    mask_file = File(exists=True, desc='Brain mask of the input image (BET), the image must be 0 outside of it')
 
 class EnhancementOutputSpec(TraitedSpec):
     output_file = File(exists=True, desc='Path to the enhanced image')
+    mask_file = File(exists=True, desc='Brain mask the enhanced image is 0 outside of: the input mask, dilated by the kernel when denoising')
 
-class EnhancementInterface(SimpleInterface):
+class EnhancementInterface(InstrumentedInterface):
     input_spec = EnhancementInputSpec
     output_spec = EnhancementOutputSpec
 
@@ -35,6 +46,7 @@ class EnhancementInterface(SimpleInterface):
         percentiles = self.inputs.percentiles
         bins_num = self.inputs.bins_num
         eh = self.inputs.eh
+        check_bins_num(bins_num, eh)
         enhanced_image_path = output_enhancement_folder / Path(input_file).name
 
         logger.info(f'Preprocess on: {input_file}')
@@ -52,14 +64,23 @@ class EnhancementInterface(SimpleInterface):
 
         try:
             # Load the image and perform enhancement
-            volume, affine = load_nii(input_file)
-            volume = denoise(volume, kernel_size)
-            volume = rescale_intensity(volume, percentiles, bins_num)
-            if eh:
-                volume = equalize_hist(volume, bins_num)
+            volume, affine = load_nii(input_file, dtype=np.float32)
+            mask_index = load_mask(self.inputs.mask_file) if isdefined(self.inputs.mask_file) else None
+            volume = denoise(volume, kernel_size, self.inputs.denoise_method, self.inputs.num_threads, mask_index)
+            # The median filter can spread the brain past the edge of the mask, by up to its radius
+            mask_index = foreground_mask_index(mask_index, kernel_size, volume.shape)
+            # Rescaling and histogram equalization in one pass over the foreground
+            volume = enhance_intensity(volume, percentiles, bins_num, eh, mask_index)
 
             save_nii(volume, str(enhanced_image_path), affine)
             self._results['output_file'] = str(enhanced_image_path)
+            if mask_index is not None and kernel_size == 1:
+                self._results['mask_file'] = self.inputs.mask_file
+            elif mask_index is not None:
+                # The dilated mask bounds the enhanced image, the segmentation searches it for the brain
+                mask_path = output_enhancement_folder / (nii_stem(input_file) + '_mask.nii.gz')
+                save_nii(scatter(np.ones(mask_index.size, dtype=np.bool_), mask_index, volume.shape), str(mask_path), affine)
+                self._results['mask_file'] = str(mask_path)
 
         except RuntimeError as e:
             logger.warning(f'Failed on: {input_file} with error: {e}')
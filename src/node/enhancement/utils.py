@@ -1,34 +1,184 @@
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+
 import numpy as np
 
-from scipy.signal import medfilt
+from utils.load_mask import dilate_index
+from utils.load_mask import foreground_index
+from utils.load_mask import scatter
 
-def denoise(volume:np.ndarray, kernel_size=3):
-    return medfilt(volume, kernel_size)
+# Upper bound of the neighbourhood stack built for one slab by the chunked median
+SLAB_STACK_BYTES = 32 * 2 ** 20
 
-def rescale_intensity(volume:np.ndarray, percentils=[0.5, 99.5], bins_num=256) -> np.ndarray:
-    obj_volume = volume[np.where(volume > 0)]
-    min_value = np.percentile(obj_volume, percentils[0])
-    max_value = np.percentile(obj_volume, percentils[1])
+def _foreground_box(volume:np.ndarray, margin:int, mask_index:np.ndarray=None) -> tuple:
+    # Bounding box of the non-zero voxels grown by `margin`. Outside of it
+    # every neighbourhood is all zeros, so its median is 0 as well.
+    if mask_index is not None:
+        # The box of the mask contains every non-zero voxel when the volume is 0 outside of it
+        if mask_index.size == 0:
+            return None
+        coords = np.unravel_index(mask_index, volume.shape, order='F')
+        return tuple(
+            slice(max(int(c.min()) - margin, 0), min(int(c.max()) + margin + 1, n))
+            for c, n in zip(coords, volume.shape)
+        )
+    nonzero = volume != 0
+    box = []
+    for axis in range(volume.ndim):
+        other_axes = tuple(a for a in range(volume.ndim) if a != axis)
+        index = np.flatnonzero(np.any(nonzero, axis=other_axes))
+        if index.size == 0:
+            return None
+        box.append(slice(max(index[0] - margin, 0), min(index[-1] + margin + 1, volume.shape[axis])))
+    return tuple(box)
 
-    if bins_num == 0:
-        obj_volume = (obj_volume - min_value) / (max_value - min_value).astype(np.float32)
+def _chunked_median(volume:np.ndarray, kernel_size:int, num_threads:int) -> np.ndarray:
+    # Exact median over z-slabs: each slab stacks the kernel_size**3 shifted
+    # views of its zero-padded neighbourhood and partitions them in place.
+    # NumPy releases the GIL while partitioning, so slabs run on threads.
+    radius = kernel_size // 2
+    n = kernel_size ** 3
+    padded = np.pad(volume, radius)
+    filtered = np.empty_like(volume)
+
+    plane_bytes = volume[0].nbytes
+    slab_size = max(1, SLAB_STACK_BYTES // (n * plane_bytes))
+    offsets = list(itertools.product(range(kernel_size), repeat=3))
+
+    def filter_slab(start):
+        stop = min(start + slab_size, volume.shape[0])
+        stacked = np.stack([
+            padded[start + i:stop + i, j:j + volume.shape[1], k:k + volume.shape[2]]
+            for i, j, k in offsets
+        ])
+        stacked.partition(n // 2, axis=0)
+        filtered[start:stop] = stacked[n // 2]
+
+    with ThreadPoolExecutor(max_workers=max(1, num_threads)) as executor:
+        list(executor.map(filter_slab, range(0, volume.shape[0], slab_size)))
+    return filtered
+
+def denoise(volume:np.ndarray, kernel_size=3, method='chunked', num_threads=1, mask_index:np.ndarray=None) -> np.ndarray:
+    """
+    3-D median filter with zero padding, equivalent to `scipy.signal.medfilt`.
+
+    Args:
+    volume (np.ndarray): Volume to denoise, kept in its own dtype except for `medfilt`.
+    kernel_size (int): Odd size of the cubic kernel; 1 returns the volume as is.
+    method (str): `chunked` (threaded z-slabs), `ndimage` (`scipy.ndimage.median_filter`)
+        or `medfilt` (`scipy.signal.medfilt`, the reference).
+    num_threads (int): Threads used by the `chunked` method.
+    mask_index (np.ndarray): Flat indices of the brain mask (see `utils.load_mask`), to find the foreground without scanning the volume.
+    """
+    if kernel_size % 2 == 0:
+        raise ValueError(f'Kernel size must be odd, got {kernel_size}')
+    if kernel_size == 1:
+        return volume
+    if method == 'medfilt':
+        # SciPy is only imported by the backends using it, it is slow to import
+        from scipy.signal import medfilt
+        return medfilt(volume, kernel_size)
+
+    # Only the foreground (plus the kernel radius) needs filtering
+    box = _foreground_box(volume, kernel_size // 2, mask_index)
+    denoised = np.zeros_like(volume)
+    if box is None:
+        return denoised
+
+    if method == 'ndimage':
+        from scipy import ndimage
+        denoised[box] = ndimage.median_filter(volume[box], size=kernel_size, mode='constant', cval=0)
+    elif method == 'chunked':
+        denoised[box] = _chunked_median(volume[box], kernel_size, num_threads)
     else:
-        obj_volume = np.round((obj_volume - min_value) / (max_value - min_value) * (bins_num - 1))
-        obj_volume[np.where(obj_volume < 1)] = 1
-        obj_volume[np.where(obj_volume > (bins_num - 1))] = bins_num - 1
+        raise ValueError(f'Unknown denoising method: {method}')
+    return denoised
 
-    volume = volume.astype(obj_volume.dtype)
-    volume[np.where(volume > 0)] = obj_volume
+def _quantized_dtype(bins_num:int) -> np.dtype:
+    return np.dtype(np.uint8) if bins_num <= 256 else np.dtype(np.uint16)
 
-    return volume
+def _rescaled_dtype(volume:np.ndarray) -> np.dtype:
+    # Float type `_rescale` computes in
+    return volume.dtype if np.issubdtype(volume.dtype, np.floating) else np.dtype(np.float64)
 
-def equalize_hist(volume:np.ndarray, bins_num=256) -> np.ndarray:
-    obj_volume = volume[np.where(volume > 0)]
-    #hist, bins = np.histogram(obj_volume, bins_num, normed=True)
-    hist, bins = np.histogram(obj_volume, bins_num)
+def _rescale(obj_volume:np.ndarray, percentiles, bins_num:int) -> np.ndarray:
+    # Works in place on `obj_volume`, a 1-D copy of the foreground voxels
+    obj_volume = obj_volume.astype(_rescaled_dtype(obj_volume), copy=False)
+    # Both percentiles from a single call. They are interpolated in float64 then
+    # cast to the precision of the volume, as two scalar calls return them.
+    min_value, max_value = np.percentile(obj_volume, np.asarray(percentiles, dtype=np.float64)).astype(obj_volume.dtype)
+    obj_volume -= min_value
+
+    if bins_num == 0:
+        # The output is float32, and so is the range it is divided by
+        obj_volume /= (max_value - min_value).astype(np.float32)
+        return obj_volume.astype(np.float32, copy=False)
+
+    obj_volume /= (max_value - min_value)
+    obj_volume *= (bins_num - 1)
+    np.round(obj_volume, out=obj_volume)
+    np.clip(obj_volume, 1, bins_num - 1, out=obj_volume)
+    return obj_volume.astype(_quantized_dtype(bins_num))
+
+def _equalization_lut(quantized:np.ndarray, bins_num:int, dtype=np.float64) -> np.ndarray:
+    # Equalization as a lookup table over the quantized levels. The histogram
+    # of the present levels weighted by their counts has the same bins as the
+    # histogram of every voxel, so the table reproduces the voxel-wise
+    # `np.interp` exactly while only touching `bins_num` values.
+    # `dtype` is the float type the levels were rounded in: `np.histogram`
+    # computes its edges in the type of the data, so float32 levels get
+    # float32 edges, and the levels must be binned in that type as well.
+    counts = np.bincount(quantized, minlength=bins_num)
+    levels = np.flatnonzero(counts)
+    hist, bins = np.histogram(levels.astype(dtype), bins_num, weights=counts[levels])
     cdf = hist.cumsum()
     cdf = (bins_num - 1) * cdf / cdf[-1]
+    lut = np.round(np.interp(np.arange(len(counts), dtype=dtype), bins[:-1], cdf))
+    return lut.astype(quantized.dtype)
+
+def check_bins_num(bins_num:int, eh:bool):
+    # Equalization counts the quantized levels, which do not exist without bins
+    if eh and bins_num <= 0:
+        raise ValueError(f'Histogram equalization needs a positive number of bins, got {bins_num}')
 
-    obj_volume = np.round(np.interp(obj_volume, bins[:-1], cdf)).astype(obj_volume.dtype)
-    volume[np.where(volume > 0)] = obj_volume
+def rescale_intensity(volume:np.ndarray, percentils=[0.5, 99.5], bins_num=256) -> np.ndarray:
+    mask = volume > 0
+    obj_volume = _rescale(volume[mask], percentils, bins_num)
+    rescaled = np.zeros(volume.shape, dtype=obj_volume.dtype)
+    rescaled[mask] = obj_volume
+    return rescaled
+
+def equalize_hist(volume:np.ndarray, bins_num=256, dtype=np.float64) -> np.ndarray:
+    # Expects the quantized output of `rescale_intensity`, `dtype` being the
+    # float type of its input (float64 for integer volumes)
+    check_bins_num(bins_num, True)
+    mask = volume > 0
+    obj_volume = volume[mask]
+    volume[mask] = _equalization_lut(obj_volume, bins_num, dtype)[obj_volume]
     return volume
+
+def foreground_mask_index(mask_index:np.ndarray, kernel_size:int, shape:tuple) -> np.ndarray:
+    # A median filter wider than one voxel can set voxels just outside the
+    # mask (in its concave parts), up to its radius, so the mask bounds the
+    # denoised foreground once dilated by the kernel
+    if mask_index is None or kernel_size == 1:
+        return mask_index
+    return dilate_index(mask_index, shape, kernel_size)
+
+def enhance_intensity(volume:np.ndarray, percentiles=[0.5, 99.5], bins_num=256, eh=True, mask_index:np.ndarray=None) -> np.ndarray:
+    """
+    Fused `rescale_intensity` and `equalize_hist`.
+
+    The foreground is found once, as flat indices, and the result is
+    written into a single uint8/uint16 volume (float32 when `bins_num` is 0),
+    so the peak memory is the input plus about one output-sized volume.
+    With `mask_index` (see `utils.load_mask`), only the voxels of the brain
+    mask are checked for the foreground.
+    """
+    check_bins_num(bins_num, eh)
+    index = foreground_index(volume, mask_index)
+    obj_volume = _rescale(volume.reshape(-1, order='F')[index], percentiles, bins_num)
+    if eh:
+        obj_volume = _equalization_lut(obj_volume, bins_num, _rescaled_dtype(volume))[obj_volume]
+
+    return scatter(obj_volume, index, volume.shape)
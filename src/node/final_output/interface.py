@@ -1,10 +1,17 @@
-import shutil
 from pathlib import Path
+import shutil
 
-from nipype.interfaces.base import (SimpleInterface, BaseInterfaceInputSpec, TraitedSpec, File, Directory, traits)
+from nipype.interfaces.base import (BaseInterfaceInputSpec, TraitedSpec, File, Directory, traits)
+from node.instrumented_interface import InstrumentedInterface
 
 from loguru import logger
 
+from node.final_output.utils import PLACE_METHODS
+from node.final_output.utils import place_file
+from node.final_output.utils import write_manifest
+
+MANIFEST_NAME = "manifest.json"
+
 class FinalOutputInputSpec(BaseInterfaceInputSpec):
     acpc_output_file = File(exists=True, desc="ACPC corrected NIfTI file (.nii)", mandatory=True)
     acpc_output_png_file = File(exists=True, desc="ACPC corrected PNG file", mandatory=True)
@@ -12,11 +19,13 @@ class FinalOutputInputSpec(BaseInterfaceInputSpec):
     wm_png_file = File(exists=True, desc="White matter segmentation PNG file", mandatory=True)
     csf_png_file = File(exists=True, desc="CSF segmentation PNG file", mandatory=True)
     output_folder = Directory(desc="Final output directory", mandatory=True)
+    mode = traits.Enum(*PLACE_METHODS, usedefault=True, desc="`link` hardlinks (or reflinks, symlinks) the files, `copy` makes independent copies (reflinks when possible)")
 
 class FinalOutputOutputSpec(TraitedSpec):
     output_folder = Directory(exists=True, desc="Directory containing organized final outputs")
+    manifest_file = File(exists=True, desc="Manifest of the final outputs, with their size and SHA-256")
 
-class OrganizeFinalOutputInterface(SimpleInterface):
+class OrganizeFinalOutputInterface(InstrumentedInterface):
     input_spec = FinalOutputInputSpec
     output_spec = FinalOutputOutputSpec
 
@@ -27,22 +36,37 @@ class OrganizeFinalOutputInterface(SimpleInterface):
 
         logger.info(f"Organizing final output in {output_dir}")
 
-        # Clean the output directory
+        # Final file names of the ACPC output and PNG files
+        sources = {
+            Path(self.inputs.acpc_output_file).name: self.inputs.acpc_output_file,
+            Path(self.inputs.acpc_output_png_file).name: self.inputs.acpc_output_png_file,
+            "GM_Segmentation.png": self.inputs.gm_png_file,
+            "WM_Segmentation.png": self.inputs.wm_png_file,
+            "CSF_Segmentation.png": self.inputs.csf_png_file,
+        }
+
+        # Clean the files of previous runs that are not part of the output anymore, the others are kept
         for file in output_dir.glob("*"):
-            if file.is_file():
+            if file.name in sources or file.name == MANIFEST_NAME:
+                continue
+            if file.is_file() or file.is_symlink():
                 file.unlink()
             if file.is_dir():
                 shutil.rmtree(file)
 
-        # Copy or move the ACPC output and PNG files to the output directory
-        shutil.copy(self.inputs.acpc_output_file, output_dir / Path(self.inputs.acpc_output_file).name)
-        shutil.copy(self.inputs.acpc_output_png_file, output_dir / Path(self.inputs.acpc_output_png_file).name)
-        shutil.copy(self.inputs.gm_png_file, output_dir / "GM_Segmentation.png")
-        shutil.copy(self.inputs.wm_png_file, output_dir / "WM_Segmentation.png")
-        shutil.copy(self.inputs.csf_png_file, output_dir / "CSF_Segmentation.png")
+        # Link or copy the files, the ones already up to date are skipped
+        entries = {}
+        for name, source in sources.items():
+            method = place_file(source, output_dir / name, self.inputs.mode)
+            logger.info(f"{name}: {method}")
+            entries[name] = (source, method)
+
+        manifest_file = output_dir / MANIFEST_NAME
+        write_manifest(manifest_file, entries)
 
         self._results['output_folder'] = str(output_dir)
+        self._results['manifest_file'] = str(manifest_file)
         return runtime
 
     def _list_outputs(self):
-        return self._results
\ No newline at end of file
+        return self._results
@@ -0,0 +1,105 @@
+import fcntl
+import json
+import os
+from pathlib import Path
+import shutil
+
+from utils.file_sha256 import file_sha256
+
+# ioctl cloning a file's extents (Btrfs, XFS, OCFS2...), `cp --reflink`
+FICLONE = 0x40049409
+
+# Ways of placing a file in the final output, tried in order
+PLACE_METHODS = {
+    # Share the source's storage: hardlink, then copy-on-write clone, then symlink
+    'link': ('hardlink', 'reflink', 'symlink', 'copy'),
+    # Independent files, cloned when the filesystem allows it
+    'copy': ('reflink', 'copy'),
+}
+
+def _reflink(input_file:Path, output_file:Path):
+    with open(input_file, 'rb') as f_in, open(output_file, 'wb') as f_out:
+        fcntl.ioctl(f_out.fileno(), FICLONE, f_in.fileno())
+    shutil.copystat(input_file, output_file)
+
+def _place(input_file:Path, output_file:Path, method:str):
+    if method == 'hardlink':
+        os.link(input_file, output_file)
+    elif method == 'reflink':
+        _reflink(input_file, output_file)
+    elif method == 'symlink':
+        os.symlink(input_file.absolute(), output_file)
+    else:
+        # Keeps the modification time, so the copy is found up to date next time
+        shutil.copy2(input_file, output_file)
+
+def is_up_to_date(input_file:Path, output_file:Path) -> bool:
+    # Same size and modification time, which links share with their source and copies keep
+    try:
+        input_stat, output_stat = input_file.stat(), output_file.stat()
+    except FileNotFoundError:
+        return False
+    return (input_stat.st_size, input_stat.st_mtime_ns) == (output_stat.st_size, output_stat.st_mtime_ns)
+
+def place_file(input_file:Path, output_file:Path, mode:str='link') -> str:
+    """
+    Make `output_file` a link to or a copy of `input_file`, skipping it when already up to date.
+
+    The methods of `mode` (see `PLACE_METHODS`) are tried in order until
+    one is supported by the filesystem. The file is placed under a
+    temporary name then renamed, so readers never see a partial file.
+
+    Returns the method used, or `skip`.
+    """
+    input_file, output_file = Path(input_file), Path(output_file)
+    if is_up_to_date(input_file, output_file):
+        return 'skip'
+
+    temp_file = output_file.with_name('.' + output_file.name + '.tmp')
+    for method in PLACE_METHODS[mode]:
+        temp_file.unlink(missing_ok=True)
+        try:
+            _place(input_file, temp_file, method)
+        except OSError:
+            if method == 'copy':
+                raise
+            continue
+        os.replace(temp_file, output_file)
+        return method
+
+def write_manifest(manifest_file:Path, entries:dict):
+    """
+    Write the manifest of the final output: size, modification time and SHA-256 of every file.
+
+    Args:
+    manifest_file (Path): Manifest to write (JSON).
+    entries (dict): Source file and placement method of every output file, by name.
+
+    The checksum of a file whose size and modification time match the
+    previous manifest is reused, so unchanged files are not read again.
+    """
+    manifest_file = Path(manifest_file)
+    previous = {}
+    if manifest_file.exists():
+        try:
+            previous = {entry['name']: entry for entry in json.loads(manifest_file.read_text())['files']}
+        except (ValueError, KeyError):
+            previous = {}
+
+    files = []
+    for name, (source, method) in entries.items():
+        stat = (manifest_file.parent / name).stat()
+        old = previous.get(name, {})
+        # A skipped file keeps the method it was placed with
+        if method == 'skip':
+            method = old.get('method', method)
+        entry = {'name': name, 'source': str(source), 'method': method, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+        if (old.get('size'), old.get('mtime_ns')) == (stat.st_size, stat.st_mtime_ns) and 'sha256' in old:
+            entry['sha256'] = old['sha256']
+        else:
+            entry['sha256'] = file_sha256(manifest_file.parent / name)
+        files.append(entry)
+
+    temp_file = manifest_file.with_name('.' + manifest_file.name + '.tmp')
+    temp_file.write_text(json.dumps({'files': files}, indent=2))
+    os.replace(temp_file, manifest_file)
@@ -0,0 +1,18 @@
+from nipype.interfaces.base import SimpleInterface
+
+from utils.stage_monitor import StageMonitor
+
+class InstrumentedInterface(SimpleInterface):
+    """
+    `SimpleInterface` recording the resources used by each run.
+
+    The metrics of `StageMonitor` (wall time, CPU time, peak RSS and I/O,
+    child processes included) are stored in `runtime.stage_metrics`, which
+    nipype saves in the node's result file for `utils.run_report`.
+    """
+
+    def run(self, cwd=None, ignore_exception=None, **inputs):
+        with StageMonitor() as monitor:
+            result = super().run(cwd=cwd, ignore_exception=ignore_exception, **inputs)
+        result.runtime.stage_metrics = monitor.metrics
+        return result
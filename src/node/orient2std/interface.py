@@ -3,8 +3,13 @@ from pathlib import Path
 
 from loguru import logger
 
-from nipype.interfaces.base import SimpleInterface, BaseInterfaceInputSpec, TraitedSpec, File, Directory
+from nipype.interfaces.base import BaseInterfaceInputSpec, TraitedSpec, File, Directory
 from nipype.interfaces.fsl import Reorient2Std
+from node.instrumented_interface import InstrumentedInterface
+
+from utils.command_runner import run_nipype_command
+
+from utils.nii_stem import nii_stem
 
 class Reorient2StdInputSpec(BaseInterfaceInputSpec):
     input_file = File(exists=True, desc='Input file to reorient', mandatory=True)
@@ -13,7 +18,7 @@ class Reorient2StdInputSpec(BaseInterfaceInputSpec):
 class Reorient2StdOutputSpec(TraitedSpec):
     output_file = File(exists=True, desc='Reoriented output file')
 
-class Reorient2StdInterface(SimpleInterface):
+class Reorient2StdInterface(InstrumentedInterface):
     input_spec = Reorient2StdInputSpec
     output_spec = Reorient2StdOutputSpec
 
@@ -21,7 +26,8 @@ class Reorient2StdInterface(SimpleInterface):
         input_file = self.inputs.input_file
         output_folder = Path(self.inputs.output_folder)
         output_orient_folder = output_folder / 'orient2std'
-        output_file = output_orient_folder / Path(input_file).name
+        # FSL reads `.nii` and `.nii.gz` alike and writes the compressed output itself
+        output_file = output_orient_folder / (nii_stem(input_file) + '.nii.gz')
 
         logger.info(f'Reorienting {input_file} to standard space')
         logger.info(f'Output file: {output_file}')
@@ -38,7 +44,7 @@ class Reorient2StdInterface(SimpleInterface):
 
         # Perform the reorientation
         reorient = Reorient2Std(in_file=input_file, out_file=str(output_file))
-        reorient.run()
+        run_nipype_command(reorient)
 
         self._results['output_file'] = str(output_file)
 
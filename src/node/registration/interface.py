@@ -2,22 +2,37 @@ import os
 import shutil
 from pathlib import Path
 
-from nipype.interfaces.base import (SimpleInterface, BaseInterfaceInputSpec, TraitedSpec, File, Directory)
+from nipype.interfaces.base import (BaseInterfaceInputSpec, TraitedSpec, File, Directory, isdefined, traits)
 from nipype.interfaces.fsl import FLIRT
+from node.instrumented_interface import InstrumentedInterface
 
 from loguru import logger
 
+from utils.command_runner import run_nipype_command
+from utils.nii_stem import nii_stem
+
+from node.registration.utils import PROFILES
+from node.registration.utils import transform_key
+from node.registration.utils import cached_transform
+from node.registration.utils import store_transform
+
 REF_NII_TEMPLATE = os.getenv('FSLDIR') + '/data/standard/MNI152_T1_1mm.nii.gz'
+# Same field of view as the 1mm template, so their FLIRT matrices are interchangeable
+COARSE_REF_NII_TEMPLATE = os.getenv('FSLDIR') + '/data/standard/MNI152_T1_2mm.nii.gz'
 
 class FLIRTInputSpec(BaseInterfaceInputSpec):
     input_file = File(exists=True, desc='Source image path (.nii.gz)', mandatory=True)
     ref_file = File(exists=True, desc='Reference image path', mandatory=False)
+    coarse_ref_file = File(exists=True, desc='Downsampled reference of the `fast` profile, with the same field of view as `ref_file`', mandatory=False)
+    profile = traits.Enum(*PROFILES, usedefault=True, desc='`accurate` estimates the transform at the reference resolution, `fast` on the coarse reference')
     output_folder = Directory(exists=False, desc='Output folder for the registered image', mandatory=True)
+    cache_dir = Directory(exists=False, desc='Cache of the estimated transforms, shared by runs and subjects', mandatory=False)
 
 class FLIRTOutputSpec(TraitedSpec):
     output_file = File(exists=True, desc='Path to the registered image')
+    output_matrix_file = File(exists=True, desc='Path to the FLIRT transform (.mat)')
 
-class FLIRTInterface(SimpleInterface):
+class FLIRTInterface(InstrumentedInterface):
     input_spec = FLIRTInputSpec
     output_spec = FLIRTOutputSpec
 
@@ -26,6 +41,7 @@ class FLIRTInterface(SimpleInterface):
         output_folder = Path(self.inputs.output_folder)
         output_reg_folder = output_folder / 'registration'
         output_file = output_reg_folder / Path(input_file).name
+        matrix_file = output_reg_folder / (nii_stem(input_file) + '.mat')
 
         # Use the default FSL reference image if ref_file is not provided
         ref_file = self.inputs.ref_file
@@ -46,24 +62,75 @@ class FLIRTInterface(SimpleInterface):
             if file.is_dir():
                 shutil.rmtree(file)
 
-        # Setup FLIRT interface
-        flirt = FLIRT(
-            in_file=input_file,
-            reference=Path(ref_file).as_posix(),
-            out_file=str(output_file),
-            bins=256,
-            cost_func='corratio',
-            searchr_x=[0, 0],
-            searchr_y=[0, 0],
-            searchr_z=[0, 0],
-            dof=12,
-            interp='spline'
-        )
-        
-        # Execute FLIRT
-        flirt.run()
+        # The fast profile estimates the transform on the coarse reference, then resamples the image once at full resolution
+        params = PROFILES[self.inputs.profile]
+        estimate_ref_file = ref_file
+        if self.inputs.profile == 'fast':
+            if isdefined(self.inputs.coarse_ref_file):
+                estimate_ref_file = self.inputs.coarse_ref_file
+            elif ref_file == REF_NII_TEMPLATE:
+                estimate_ref_file = COARSE_REF_NII_TEMPLATE
+            else:
+                logger.warning('No coarse reference for {}, estimating at its resolution'.format(ref_file))
+
+        # Look up the transform of the same image, reference and parameters
+        cache_dir = self.inputs.cache_dir if isdefined(self.inputs.cache_dir) else None
+        key = transform_key(input_file, estimate_ref_file, {'profile': self.inputs.profile, **params}) if cache_dir else None
+        cached_matrix_file = cached_transform(cache_dir, key) if key else None
+
+        if cached_matrix_file:
+            logger.info('Applying cached transform: {}'.format(cached_matrix_file))
+            in_matrix_file = cached_matrix_file
+        elif estimate_ref_file == ref_file:
+            # Setup FLIRT interface, estimating the transform and resampling the image in one run
+            flirt = FLIRT(
+                in_file=input_file,
+                reference=Path(ref_file).as_posix(),
+                out_file=str(output_file),
+                out_matrix_file=str(matrix_file),
+                interp='spline',
+                **params
+            )
+            run_nipype_command(flirt)
+            in_matrix_file = None
+        else:
+            logger.info('Estimating the transform on: {}'.format(estimate_ref_file))
+            # Setup FLIRT interface, the coarse output is only a by-product of the estimation
+            coarse_output_file = output_reg_folder / ('coarse_' + Path(input_file).name)
+            coarse_matrix_file = output_reg_folder / ('coarse_' + matrix_file.name)
+            flirt = FLIRT(
+                in_file=input_file,
+                reference=Path(estimate_ref_file).as_posix(),
+                out_file=str(coarse_output_file),
+                out_matrix_file=str(coarse_matrix_file),
+                interp='trilinear',
+                **params
+            )
+            run_nipype_command(flirt)
+            coarse_output_file.unlink(missing_ok=True)
+            in_matrix_file = coarse_matrix_file
+
+        if in_matrix_file:
+            # Setup FLIRT interface, only resampling the image with the matrix (also written to -omat)
+            flirt = FLIRT(
+                in_file=input_file,
+                reference=Path(ref_file).as_posix(),
+                out_file=str(output_file),
+                out_matrix_file=str(matrix_file),
+                apply_xfm=True,
+                in_matrix_file=str(in_matrix_file),
+                interp='spline'
+            )
+            run_nipype_command(flirt)
+
+            if in_matrix_file != cached_matrix_file:
+                in_matrix_file.unlink()
+
+        if key and not cached_matrix_file:
+            store_transform(cache_dir, key, matrix_file)
 
         self._results['output_file'] = str(output_file)
+        self._results['output_matrix_file'] = str(matrix_file)
 
         return runtime
 
@@ -0,0 +1,64 @@
+import json
+import hashlib
+import os
+import shutil
+from pathlib import Path
+from typing import Optional
+
+from utils.file_sha256 import file_sha256
+
+# Bump when the way a transform is estimated changes, to invalidate the cached matrices
+CACHE_VERSION = 1
+
+def transform_key(input_file:str, ref_file:str, params:dict) -> str:
+    """
+    Content address of the FLIRT transform of `input_file` to `ref_file` estimated with `params`.
+
+    Args:
+    input_file (str): Moving image.
+    ref_file (str): Reference image.
+    params (dict): FLIRT parameters the estimation depends on (cost, bins, dof, search ranges, ...).
+    """
+    key = {
+        'version': CACHE_VERSION,
+        'input': file_sha256(input_file),
+        'reference': file_sha256(ref_file),
+        'params': params,
+    }
+    return hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()
+
+def cached_transform(cache_dir:str, key:str) -> Optional[Path]:
+    path = Path(cache_dir) / key[:2] / f'{key}.mat'
+    return path if path.is_file() else None
+
+def store_transform(cache_dir:str, key:str, matrix_file:str) -> Path:
+    """
+    Copy a FLIRT matrix into the cache, atomically so concurrent subjects/shards never read a partial file.
+    """
+    path = Path(cache_dir) / key[:2] / f'{key}.mat'
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temp_path = path.with_suffix(f'.{os.getpid()}.tmp')
+    shutil.copyfile(matrix_file, temp_path)
+    os.replace(temp_path, path)
+    return path
+
+# Parameters of the transform estimation per registration profile, also part of the cache key.
+# `fast` estimates on a 2mm reference with a coarser joint histogram, see FLIRTInterface.
+PROFILES = {
+    'accurate': dict(
+        bins=256,
+        cost_func='corratio',
+        searchr_x=[0, 0],
+        searchr_y=[0, 0],
+        searchr_z=[0, 0],
+        dof=12,
+    ),
+    'fast': dict(
+        bins=128,
+        cost_func='corratio',
+        searchr_x=[0, 0],
+        searchr_y=[0, 0],
+        searchr_z=[0, 0],
+        dof=12,
+    ),
+}
@@ -1,30 +1,37 @@
+import os
 import shutil
 from pathlib import Path
 
-from nipype.interfaces.base import (SimpleInterface, BaseInterfaceInputSpec, TraitedSpec, File, Directory)
+from nipype.interfaces.base import (BaseInterfaceInputSpec, TraitedSpec, File, Directory, traits, isdefined)
+from node.instrumented_interface import InstrumentedInterface
 from loguru import logger
 
+from utils.load_mask import load_mask
 from utils.load_nii import load_nii
 from utils.save_nii import save_nii
 
+from node.segmentation.utils import KMEANS_ENGINES
 from node.segmentation.utils import kmeans_cluster
 from node.segmentation.utils import get_target_labels
-from node.segmentation.utils import segment
+from node.segmentation.utils import segment_tissues
 
 class SegmentationInputSpec(BaseInterfaceInputSpec):
     input_file = File(exists=True, desc='Source image path (.nii.gz)', mandatory=True)
     output_folder = Directory(exists=False, desc='Output folder for the segmented image', mandatory=True)
+    kmeans_engine = traits.Enum(*KMEANS_ENGINES, usedefault=True, desc='K-means backend (`sklearn` fits on every voxel, `histogram` on the intensity histogram, exactly, so its partition may differ)')
+    mask_file = File(exists=True, desc='Brain mask of the input image (BET), the image must be 0 outside of it')
 
 class SegmentationOutputSpec(TraitedSpec):
     gm_segmented_output_file = File(exists=True, desc='Path to GM segmented image')
     wm_segmented_output_file = File(exists=True, desc='Path to WM segmented image')
     csf_segmented_output_file = File(exists=True, desc='Path to CSF segmented image')
 
+    # The same uint8 label volume, written once and hardlinked under the three names
     gm_labels_output_file = File(exists=True, desc='Path to GM labels image')
     wm_labels_output_file = File(exists=True, desc='Path to WM labels image')
     csf_labels_output_file = File(exists=True, desc='Path to CSF labels image')
 
-class SegmentationInterface(SimpleInterface):
+class SegmentationInterface(InstrumentedInterface):
     input_spec = SegmentationInputSpec
     output_spec = SegmentationOutputSpec
 
@@ -57,26 +64,28 @@ class SegmentationInterface(SimpleInterface):
 
         try:
             # Load the image data and perform K-means clustering
-            data, affine = load_nii(input_file)
+            mask_index = load_mask(self.inputs.mask_file) if isdefined(self.inputs.mask_file) else None
+            data, affine, mask_index = self._load_volume(input_file, mask_index)
             
             # Split the data into 3 clusters (GM, WM, CSF)
             n_clusters = 3
 
-            labels = kmeans_cluster(data, n_clusters)
+            labels = kmeans_cluster(data, n_clusters, self.inputs.kmeans_engine, mask_index)
 
-            gm_target, wm_target, csf_target = get_target_labels(labels, data)
-
-            g_matter = segment(labels, data, gm_target)
+            # The label volume is shared by the three tissues, so it is written once and linked under the other names
             save_nii(labels, str(gm_labels_path), affine)
-            save_nii(g_matter, str(gm_segmented_image_path), affine)
-
-            w_matter = segment(labels, data, wm_target)
-            save_nii(labels, str(wm_labels_path), affine)
-            save_nii(w_matter, str(wm_segmented_image_path), affine)
-
-            c_matter = segment(labels, data, csf_target)
-            save_nii(labels, str(csf_labels_path), affine)
-            save_nii(c_matter, str(csf_segmented_image_path), affine)
+            for labels_path in (wm_labels_path, csf_labels_path):
+                try:
+                    os.link(gm_labels_path, labels_path)
+                except OSError:
+                    # Filesystem without hardlinks
+                    labels_path.symlink_to(gm_labels_path.name)
+
+            # Targets are ordered as GM, WM, CSF; each map is saved before the next one is built
+            targets = get_target_labels(labels, data, mask_index)
+            segmented_image_paths = [gm_segmented_image_path, wm_segmented_image_path, csf_segmented_image_path]
+            for segmented_image_path, matter in zip(segmented_image_paths, segment_tissues(labels, data, targets, mask_index)):
+                save_nii(matter, str(segmented_image_path), affine)
 
             self._results['gm_segmented_output_file'] = str(gm_segmented_image_path)
             self._results['gm_labels_output_file'] = str(gm_labels_path)
@@ -90,5 +99,11 @@ class SegmentationInterface(SimpleInterface):
 
         return runtime
 
+    def _load_volume(self, input_file:str, mask_index):
+        # The enhanced image is kept in its quantized on-disk type (uint8).
+        # Returns the mask index too, as long as the volume is 0 outside of it.
+        data, affine = load_nii(input_file)
+        return data, affine, mask_index
+
     def _list_outputs(self):
         return self._results
@@ -1,19 +1,22 @@
-from typing import List
+from typing import Iterator, List
 
+from loguru import logger
 import numpy as np
-from sklearn.cluster import KMeans
+
+from utils.load_mask import foreground_index
+from utils.load_mask import scatter
 
 def extract_features(data:np.ndarray) -> np.ndarray:
-    x_idx, y_idx, z_idx = np.where(data > 0)
-    features = []
-    for x, y, z in zip(x_idx, y_idx, z_idx):
-        features.append([data[x, y, z], x, y, z])
-    return np.array(features)
+    # One row per foreground voxel: [intensity, x, y, z]
+    x_idx, y_idx, z_idx = np.nonzero(data > 0)
+    return np.column_stack((data[x_idx, y_idx, z_idx], x_idx, y_idx, z_idx))
+
 
+def sklearn_kmeans(intensities:np.ndarray, n_clusters:int) -> np.ndarray:
+    # Default engine: fit on every foreground voxel
+    # scikit-learn is imported here, the `histogram` engine doesn't need it and it is slow to import
+    from sklearn.cluster import KMeans
 
-def kmeans_cluster(data:np.ndarray, n_clusters:int) -> np.ndarray:
-    features = extract_features(data)
-    intensities = features[..., 0].reshape((-1, 1))
     kmeans_model = KMeans(
         n_clusters=n_clusters,
         init="k-means++",
@@ -21,37 +24,187 @@ def kmeans_cluster(data:np.ndarray, n_clusters:int) -> np.ndarray:
         random_state=42,
         max_iter=100,
         tol=1e-6
-    ).fit(intensities)
+    ).fit(intensities.reshape((-1, 1)))
+    return kmeans_model.labels_
+
+
+# Above this number of distinct intensities (e.g. without quantization), the
+# exact fit is too costly and k-means++ restarts are used instead
+EXACT_MAX_LEVELS = 4096
+
+
+def _segment_costs(cum_w:np.ndarray, cum_wv:np.ndarray, cum_wv2:np.ndarray, starts:np.ndarray, end:int) -> np.ndarray:
+    # Weighted sum of squares of the levels [start, end] around their mean, for every start
+    w = cum_w[end + 1] - cum_w[starts]
+    wv = cum_wv[end + 1] - cum_wv[starts]
+    wv2 = cum_wv2[end + 1] - cum_wv2[starts]
+    return np.maximum(wv2 - wv * wv / w, 0)
+
+
+def exact_kmeans_levels(values:np.ndarray, counts:np.ndarray, n_clusters:int) -> np.ndarray:
+    """
+    Optimal 1-D K-means of weighted sorted distinct values, by dynamic programming.
+
+    In 1-D the clusters of an optimal partition are contiguous runs of the
+    sorted values, so the lowest inertia over `k` clusters ending at level
+    `j` is the best split of the levels before `j` into `k - 1` clusters
+    plus one last run. O(n_clusters * levels^2), a few ms for 256 levels.
+
+    Returns the cluster (0..n_clusters-1, by increasing value) of every level.
+    """
+    n = len(values)
+    zero = np.zeros(1)
+    cum_w = np.concatenate((zero, np.cumsum(counts)))
+    cum_wv = np.concatenate((zero, np.cumsum(counts * values)))
+    cum_wv2 = np.concatenate((zero, np.cumsum(counts * values * values)))
+
+    # cost[j]: lowest inertia of the levels 0..j in the current number of clusters
+    cost = _segment_costs(cum_w, cum_wv, cum_wv2, np.zeros(n, dtype=np.intp), np.arange(n))
+    # first[k, j]: first level of the last cluster of the best partition of 0..j in k + 1 clusters
+    first = np.zeros((n_clusters, n), dtype=np.intp)
+    for k in range(1, n_clusters):
+        new_cost = np.full(n, np.inf)
+        # Level j closes cluster k, which starts at some level i in k..j
+        for j in range(k, n):
+            starts = np.arange(k, j + 1)
+            total = cost[starts - 1] + _segment_costs(cum_w, cum_wv, cum_wv2, starts, j)
+            best = int(np.argmin(total))
+            new_cost[j], first[k, j] = total[best], starts[best]
+        cost = new_cost
+
+    level_labels = np.empty(n, dtype=np.intp)
+    end = n
+    for k in range(n_clusters - 1, -1, -1):
+        start = first[k, end - 1]
+        level_labels[start:end] = k
+        end = start
+    return level_labels
+
+
+def _lloyd_levels(values:np.ndarray, counts:np.ndarray, centers:np.ndarray, max_iter:int, tol:float):
+    # Lloyd's algorithm on weighted sorted values, from sorted `centers`
+    for _ in range(max_iter):
+        # In 1-D the nearest center is decided by the midpoints between sorted centers
+        assignment = np.searchsorted((centers[1:] + centers[:-1]) / 2, values)
+        weights = np.bincount(assignment, weights=counts, minlength=len(centers))
+        sums = np.bincount(assignment, weights=counts * values, minlength=len(centers))
+        # Keep the previous center of an empty cluster
+        new_centers = np.where(weights > 0, sums / np.maximum(weights, 1), centers)
+        shift = np.sum((new_centers - centers) ** 2)
+        centers = np.sort(new_centers)
+        if shift <= tol:
+            break
+    assignment = np.searchsorted((centers[1:] + centers[:-1]) / 2, values)
+    inertia = np.sum(counts * (values - centers[assignment]) ** 2)
+    return assignment, inertia
 
-    labels = np.zeros(data.shape)
-    for l, f in zip(kmeans_model.labels_, features):
-        labels[int(f[1]), int(f[2]), int(f[3])] = l + 1
+
+def restarted_kmeans_levels(values:np.ndarray, counts:np.ndarray, n_clusters:int, n_init:int=10,
+                            max_iter:int=100, tol:float=1e-6, seed:int=42) -> np.ndarray:
+    # Weighted k-means++ seeding then Lloyd's algorithm, `n_init` times, keeping the lowest inertia
+    rng = np.random.default_rng(seed)
+    # Same stopping rule as sklearn: tolerance relative to the data variance
+    mean = np.average(values, weights=counts)
+    tol = tol * np.average((values - mean) ** 2, weights=counts)
+
+    best_assignment, best_inertia = None, np.inf
+    for _ in range(n_init):
+        centers = [values[rng.choice(len(values), p=counts / counts.sum())]]
+        for _ in range(1, n_clusters):
+            distances = counts * np.min((values[:, None] - np.array(centers)[None, :]) ** 2, axis=1)
+            centers.append(values[rng.choice(len(values), p=distances / distances.sum())])
+        assignment, inertia = _lloyd_levels(values, counts, np.sort(centers), max_iter, tol)
+        if inertia < best_inertia:
+            best_assignment, best_inertia = assignment, inertia
+    return best_assignment
+
+
+def histogram_kmeans(intensities:np.ndarray, n_clusters:int) -> np.ndarray:
+    # K-means on the weighted histogram of the distinct intensities. The
+    # enhancement stage quantizes to `bins_num` levels, so the fit is
+    # exact (lowest possible inertia) and costs O(bins^2) instead of O(voxels).
+    # sklearn may stop in a local optimum, so the partition, and the tissue
+    # maps, can differ from the `sklearn` engine's.
+    values, inverse, counts = np.unique(intensities, return_inverse=True, return_counts=True)
+    if len(values) == 0:
+        raise ValueError('No foreground voxel to cluster')
+    if len(values) <= n_clusters:
+        # One cluster per distinct intensity, as many as there are
+        if len(values) < n_clusters:
+            logger.warning(f'Only {len(values)} distinct intensities for {n_clusters} clusters')
+        return inverse.reshape(intensities.shape)
+
+    values, counts = values.astype(np.float64), counts.astype(np.float64)
+    if len(values) <= EXACT_MAX_LEVELS:
+        level_labels = exact_kmeans_levels(values, counts, n_clusters)
+    else:
+        level_labels = restarted_kmeans_levels(values, counts, n_clusters)
+    return level_labels[inverse.reshape(intensities.shape)]
+
+
+# The first one is the default
+KMEANS_ENGINES = {
+    'sklearn': sklearn_kmeans,
+    'histogram': histogram_kmeans,
+}
+
+
+def kmeans_cluster(data:np.ndarray, n_clusters:int, engine:str='sklearn', mask_index:np.ndarray=None) -> np.ndarray:
+    # Only the intensity is clustered, so the boolean mask is enough to
+    # gather the samples and to scatter the labels back in one assignment
+    if mask_index is not None:
+        # Only the voxels of the brain mask are searched for the foreground
+        index = foreground_index(data, mask_index)
+        model_labels = KMEANS_ENGINES[engine](data.reshape(-1, order='F')[index], n_clusters)
+        return scatter((model_labels + 1).astype(np.min_scalar_type(n_clusters)), index, data.shape)
+
+    mask = data > 0
+    model_labels = KMEANS_ENGINES[engine](data[mask], n_clusters)
+
+    # Labels are stored as small integers so they can index lookup tables
+    labels = np.zeros(data.shape, dtype=np.min_scalar_type(n_clusters))
+    labels[mask] = model_labels + 1
 
     return labels
 
-def get_target_labels(labels:np.ndarray, data:np.ndarray) -> List[int]:
-    labels_set = np.unique(labels)
-    mean_intensities = []
-    for label in labels_set[1:]:
-        label_data = data[np.where(labels == label)]
-        mean_intensities.append(np.mean(label_data))
-    gm_target_intensity = np.median(mean_intensities)  # GM
-    wm_target_intensity = np.max(mean_intensities)  # WM
-    csf_target_intensity = np.min(mean_intensities)  # CSF
+def get_target_labels(labels:np.ndarray, data:np.ndarray, mask_index:np.ndarray=None) -> List[int]:
+    # Voxel count and intensity sum of every label in one pass over the volume,
+    # or over the brain mask only (background voxels are label 0, skipped below)
+    flat_labels, flat_data = labels.ravel(), data.ravel()
+    if mask_index is not None:
+        flat_labels = labels.reshape(-1, order='F')[mask_index]
+        flat_data = data.reshape(-1, order='F')[mask_index]
+    flat_labels = flat_labels.astype(np.intp, copy=False)
+    counts = np.bincount(flat_labels)
+    sums = np.bincount(flat_labels, weights=flat_data)
+
+    # Label 0 is the background
+    present = np.flatnonzero(counts[1:]) + 1
+    mean_intensities = sums[present] / counts[present]
+    by_intensity = present[np.argsort(mean_intensities, kind='stable')]
+
     target_labels = [
-        mean_intensities.index(gm_target_intensity) + 1, # +1 because labels start at 1
-        mean_intensities.index(wm_target_intensity) + 1,
-        mean_intensities.index(csf_target_intensity) + 1
+        int(by_intensity[len(by_intensity) // 2]),  # GM
+        int(by_intensity[-1]),  # WM
+        int(by_intensity[0]),  # CSF
     ]
     return target_labels
 
 
-def segment(labels:np.ndarray, data:np.ndarray, target:int):
-    # =====================
-    mask = np.copy(labels).astype(np.float32)
-    mask[np.where(mask != target)] = 0.333
-    mask[np.where(mask == target)] = 1.
-    data = data.astype(np.float32)
-    matter = np.multiply(data, mask)
-    # =====================
-    return matter
\ No newline at end of file
+def segment_tissues(labels:np.ndarray, data:np.ndarray, targets:List[int], mask_index:np.ndarray=None) -> Iterator[np.ndarray]:
+    # One row per target: voxels of the target label keep their intensity,
+    # the others are weighted by 0.333. Each map is a single gather through
+    # the label volume, yielded one at a time to keep a single map in memory.
+    # With `mask_index`, only the brain voxels are computed, the rest is 0 as
+    # the intensity of the background is.
+    lut = np.full((len(targets), int(labels.max()) + 1), 0.333, dtype=np.float32)
+    lut[np.arange(len(targets)), targets] = 1.
+    shape = labels.shape
+    if mask_index is not None:
+        labels = labels.reshape(-1, order='F')[mask_index]
+        data = data.reshape(-1, order='F')[mask_index]
+    data = data.astype(np.float32, copy=False)
+    for weights in lut:
+        matter = weights[labels]
+        matter *= data
+        yield matter if mask_index is None else scatter(matter, mask_index, shape)
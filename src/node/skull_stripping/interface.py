@@ -1,8 +1,13 @@
 import shutil
 from pathlib import Path
 
-from nipype.interfaces.base import (SimpleInterface, BaseInterfaceInputSpec, TraitedSpec, File, traits)
+from nipype.interfaces.base import (BaseInterfaceInputSpec, TraitedSpec, File, traits)
 from nipype.interfaces.fsl import BET
+from node.instrumented_interface import InstrumentedInterface
+
+from utils.command_runner import run_nipype_command
+
+from node.skull_stripping.utils import compact_mask
 
 class SkullStrippingInputSpec(BaseInterfaceInputSpec):
     input_file = File(exists=True, desc='Source image path (.nii.gz)', mandatory=True)
@@ -11,8 +16,9 @@ class SkullStrippingInputSpec(BaseInterfaceInputSpec):
 
 class SkullStrippingOutputSpec(TraitedSpec):
     output_file = File(exists=True, desc='Path to the extracted brain image')
+    mask_file = File(exists=True, desc='Path to the binary brain mask (uint8)')
 
-class SkullStrippingInterface(SimpleInterface):
+class SkullStrippingInterface(InstrumentedInterface):
     input_spec = SkullStrippingInputSpec
     output_spec = SkullStrippingOutputSpec
 
@@ -35,10 +41,14 @@ class SkullStrippingInterface(SimpleInterface):
             if file.is_dir():
                 shutil.rmtree(file)
 
-        bet = BET(in_file=input_file, out_file=output_file, frac=frac, robust=True)
-        res = bet.run()
+        # The brain mask is saved as well, so the next nodes don't search the whole grid for the brain
+        bet = BET(in_file=input_file, out_file=output_file, frac=frac, robust=True, mask=True)
+        outputs = run_nipype_command(bet)
+        # BET writes the mask in the type of the image (float32 after N4's input), 1 byte per voxel is enough
+        compact_mask(outputs.mask_file)
 
-        self._results['output_file'] = res.outputs.out_file # here get BET's output named `out_file`
+        self._results['output_file'] = outputs.out_file # here get BET's output named `out_file`
+        self._results['mask_file'] = outputs.mask_file
 
         return runtime
 
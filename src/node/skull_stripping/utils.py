@@ -0,0 +1,16 @@
+import numpy as np
+import nibabel as nib
+
+def compact_mask(mask_file:str):
+    """
+    Rewrite a binary mask (e.g. BET's `_mask`, in the type of its input image) as uint8, in place.
+
+    The header is kept, so the mask stays on the grid of its image
+    (qform/sform codes, units) for tools matching them, e.g. N4.
+    """
+    nii = nib.load(mask_file)
+    mask = np.asanyarray(nii.dataobj) > 0
+    header = nii.header.copy()
+    header.set_data_dtype(np.uint8)
+    header.set_slope_inter(1, 0)
+    nib.save(nib.Nifti1Image(mask.view(np.uint8), nii.affine, header), mask_file)
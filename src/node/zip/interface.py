@@ -1,25 +1,30 @@
 from pathlib import Path
 
-import gzip
 import shutil
 
 from loguru import logger
 
-from nipype.interfaces.base import SimpleInterface
 from nipype.interfaces.base import BaseInterfaceInputSpec
 from nipype.interfaces.base import TraitedSpec
 from nipype.interfaces.base import File
 from nipype.interfaces.base import Directory
+from nipype.interfaces.base import traits
+from node.instrumented_interface import InstrumentedInterface
 
+from node.zip.utils import gzip_file
+from node.zip.utils import link_file
 
 class ZipOutputInputSpec(BaseInterfaceInputSpec):
     input_file = File(exists=True, desc='Input file to compress', mandatory=True)
     output_folder = Directory(exists=True, desc='Path to the output folder', mandatory=False)
+    mode = traits.Enum('gzip', 'link', usedefault=True, desc='`gzip` compresses the file, `link` passes it through as a symlink')
+    compress_level = traits.Range(1, 9, 6, usedefault=True, desc='gzip compression level (1: fastest, 9: smallest)')
+    num_threads = traits.Int(1, usedefault=True, desc='Number of gzip compression threads')
 
 class ZipOutputOutputSpec(TraitedSpec):
     output_file = File(exists=True, desc='Output compressed file', mandatory=True)
 
-class ZipOutputInterface(SimpleInterface):
+class ZipOutputInterface(InstrumentedInterface):
     input_spec = ZipOutputInputSpec
     output_spec = ZipOutputOutputSpec
 
@@ -27,25 +32,28 @@ class ZipOutputInterface(SimpleInterface):
         input_file = self.inputs.input_file
         output_folder = self.inputs.output_folder
         output_zip_folder = Path(output_folder) / 'zip'
-        output_file = output_zip_folder / (Path(input_file).name + '.gz')
+        # Already compressed inputs are passed through as well
+        link = self.inputs.mode == 'link' or input_file.endswith('.gz')
+        output_file = output_zip_folder / (Path(input_file).name + ('' if link else '.gz'))
 
-        logger.info('Compressing {} to {}'.format(input_file, output_file))
+        logger.info('{} {} to {}'.format('Linking' if link else 'Compressing', input_file, output_file))
 
         # Create the output directory if it doesn't exist
         output_zip_folder.mkdir(parents=True, exist_ok=True)
 
         # Clean the folder
         for file in output_zip_folder.glob('*'):
-            if file.is_file():
+            if file.is_file() or file.is_symlink():
                 file.unlink()
             if file.is_dir():
                 shutil.rmtree(file)
-        
-        # Compress the directory
-        with open(input_file, 'rb') as f_in, gzip.open(output_file, 'wb') as f_out:
-            shutil.copyfileobj(f_in, f_out)
 
-        self._results['output_file'] = output_file
+        if link:
+            link_file(input_file, output_file)
+        else:
+            gzip_file(input_file, output_file, self.inputs.compress_level, self.inputs.num_threads)
+
+        self._results['output_file'] = output_file.as_posix()
         return runtime
 
     def _list_outputs(self):
@@ -0,0 +1,43 @@
+import gzip
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+# Uncompressed bytes per gzip member when compressing on several threads
+CHUNK_SIZE = 16 * 2 ** 20
+
+def gzip_file(input_file:Path, output_file:Path, compress_level:int=6, num_threads:int=1):
+    """
+    Compress `input_file` into `output_file` with gzip.
+
+    With several threads the input is split into chunks compressed
+    independently and written as consecutive gzip members, which zlib
+    (FSL, ANTs) and Python's gzip (nibabel) read as a single stream.
+    zlib releases the GIL, so the chunks compress in parallel.
+
+    Args:
+    input_file (Path): File to compress.
+    output_file (Path): Compressed file to write.
+    compress_level (int): zlib compression level (1: fastest, 9: smallest).
+    num_threads (int): Number of compression threads.
+    """
+    if num_threads <= 1:
+        with open(input_file, 'rb') as f_in, gzip.open(output_file, 'wb', compresslevel=compress_level) as f_out:
+            while chunk := f_in.read(CHUNK_SIZE):
+                f_out.write(chunk)
+        return
+
+    with open(input_file, 'rb') as f_in, open(output_file, 'wb') as f_out, ThreadPoolExecutor(num_threads) as executor:
+        # Keep a bounded number of chunks in flight and write them in order
+        pending = deque()
+        while chunk := f_in.read(CHUNK_SIZE):
+            pending.append(executor.submit(gzip.compress, chunk, compress_level, mtime=0))
+            if len(pending) >= 2 * num_threads:
+                f_out.write(pending.popleft().result())
+        while pending:
+            f_out.write(pending.popleft().result())
+
+def link_file(input_file:Path, output_file:Path):
+    # Pass the file through without compression, FSL reads `.nii` as well
+    os.symlink(Path(input_file).absolute(), output_file)
@@ -0,0 +1,281 @@
+"""
+Command-line entry point of the preprocessing pipeline.
+
+    python -m preprocess run --input-dir /data --output-dir /output [options]
+
+Run from `src` (the Docker image's working directory).
+"""
+import argparse
+import json
+import os
+from pathlib import Path
+
+from loguru import logger
+
+from node.segmentation.utils import KMEANS_ENGINES
+from preprocess.subjects import DEFAULT_INCLUDE, SHARD_METHODS, discover_inputs, parse_shard, select_shard, subject_name
+from preprocess.watch import add_watch_arguments, watch
+
+def _env_flag(name:str) -> bool:
+    return os.getenv(name, '').lower() in ('1', 'true', 'yes')
+
+def _shard(value:str):
+    try:
+        return parse_shard(value)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+def _absolute_path(value:str) -> Path:
+    # Every nipype node runs in its own working directory, so the paths given to the nodes must be absolute
+    return Path(value).resolve()
+
+def _tool_value(kind):
+    # Parser of `TOOL=VALUE` arguments
+    def parse(value:str):
+        tool, separator, number = value.partition('=')
+        try:
+            if not tool or not separator:
+                raise ValueError
+            return tool, kind(number)
+        except ValueError:
+            raise argparse.ArgumentTypeError(f'Expected TOOL={kind.__name__.upper()}, got {value!r}')
+    return parse
+
+def _available_cpus() -> int:
+    # CPUs this process may run on, which is the allocation under SLURM/cgroups
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+def add_run_arguments(parser:argparse.ArgumentParser):
+    paths = parser.add_argument_group('inputs and outputs')
+    paths.add_argument(
+        '--input-dir', type=_absolute_path, default=os.getenv('PREPROCESS_INPUT_DIR', '/data'),
+        help='Folder holding the scans (env: PREPROCESS_INPUT_DIR, default: /data)'
+    )
+    paths.add_argument(
+        '--output-dir', type=_absolute_path, default=os.getenv('PREPROCESS_OUTPUT_DIR', '/output'),
+        help='Root output folder, one subfolder per subject (env: PREPROCESS_OUTPUT_DIR, default: /output)'
+    )
+    paths.add_argument(
+        '--include', action='append', metavar='GLOB',
+        help='Glob of input files relative to the input folder, repeatable (default: *.nii and *.nii.gz)'
+    )
+    paths.add_argument(
+        '--exclude', action='append', default=[], metavar='PATTERN',
+        help='Pattern of input files to skip, relative to the input folder, repeatable'
+    )
+    paths.add_argument(
+        '--shard', type=_shard, default=os.getenv('PREPROCESS_SHARD'), metavar='i/N',
+        help='Only process shard i (0-based) of N, e.g. $SLURM_ARRAY_TASK_ID/$SLURM_ARRAY_TASK_COUNT (env: PREPROCESS_SHARD)'
+    )
+    paths.add_argument(
+        '--shard-by', choices=SHARD_METHODS, default=os.getenv('PREPROCESS_SHARD_BY', 'order'),
+        help='`order` splits the sorted subjects evenly, `hash` keeps every subject on the same shard when scans are added or removed (env: PREPROCESS_SHARD_BY)'
+    )
+    paths.add_argument(
+        '--dry-run', action='store_true',
+        help='Print the subjects and settings of the run without processing anything'
+    )
+
+    execution = parser.add_argument_group('execution')
+    execution.add_argument(
+        '--plugin', choices=['Linear', 'MultiProc'], default=os.getenv('PREPROCESS_PLUGIN', 'Linear'),
+        help='Nipype execution plugin (env: PREPROCESS_PLUGIN)'
+    )
+    execution.add_argument(
+        '--n-procs', type=int, default=int(os.getenv('PREPROCESS_N_PROCS', _available_cpus())),
+        help='Processors available to MultiProc (env: PREPROCESS_N_PROCS)'
+    )
+    execution.add_argument(
+        '--memory-gb', type=float, default=os.getenv('PREPROCESS_MEMORY_GB'),
+        help='Memory (GB) available to MultiProc, defaults to 90%% of the system memory (env: PREPROCESS_MEMORY_GB)'
+    )
+    execution.add_argument(
+        '--incremental', action='store_true', default=_env_flag('PREPROCESS_INCREMENTAL'),
+        help='Keep previous outputs and only rerun the nodes whose inputs changed (env: PREPROCESS_INCREMENTAL)'
+    )
+    execution.add_argument(
+        '--work-dir', type=_absolute_path, default=os.getenv('PREPROCESS_WORK_DIR'),
+        help='Persistent nipype working directory holding the node cache, defaults to <output>/.nipype (env: PREPROCESS_WORK_DIR)'
+    )
+    execution.add_argument(
+        '--write-graph', action='store_true', default=_env_flag('PREPROCESS_WRITE_GRAPH'),
+        help='Draw the workflow graph (graph.png, graph_detailed.png) in the current directory, needs graphviz (env: PREPROCESS_WRITE_GRAPH)'
+    )
+
+    stages = parser.add_argument_group('stages')
+    stages.add_argument(
+        '--zip-mode', choices=['gzip', 'link'], default=os.getenv('PREPROCESS_ZIP_MODE', 'link'),
+        help='How the ACPC output is handed to FSL: `link` passes the .nii through, `gzip` compresses it (env: PREPROCESS_ZIP_MODE)'
+    )
+    stages.add_argument(
+        '--zip-level', type=int, choices=range(1, 10), default=6, metavar='{1..9}',
+        help='gzip compression level of `--zip-mode gzip`'
+    )
+    stages.add_argument(
+        '--zip-threads', type=int, default=1,
+        help='gzip compression threads of `--zip-mode gzip`'
+    )
+    stages.add_argument(
+        '--registration-profile', choices=['accurate', 'fast'], default=os.getenv('PREPROCESS_REGISTRATION_PROFILE', 'accurate'),
+        help='`fast` estimates the FLIRT transform on the 2mm template, then resamples the image once at 1mm (env: PREPROCESS_REGISTRATION_PROFILE)'
+    )
+    stages.add_argument(
+        '--registration-cache', type=_absolute_path, default=os.getenv('PREPROCESS_REGISTRATION_CACHE'),
+        help='Cache of the FLIRT transforms, keyed on the image content and FLIRT parameters, defaults to <work-dir>/flirt_cache (env: PREPROCESS_REGISTRATION_CACHE)'
+    )
+    stages.add_argument(
+        '--no-registration-cache', action='store_true',
+        help='Always estimate the FLIRT transform'
+    )
+    stages.add_argument(
+        '--n4-profile', choices=['accurate', 'fast'], default=os.getenv('PREPROCESS_N4_PROFILE', 'accurate'),
+        help='`fast` fits the N4 bias field with a larger shrink factor and fewer iterations (env: PREPROCESS_N4_PROFILE)'
+    )
+    stages.add_argument(
+        '--n4-threads', type=int, default=int(os.getenv('PREPROCESS_N4_THREADS', 1)),
+        help='ITK threads of N4, also reserved for the node by MultiProc (env: PREPROCESS_N4_THREADS)'
+    )
+    stages.add_argument(
+        '--kmeans-engine', choices=list(KMEANS_ENGINES), default=os.getenv('PREPROCESS_KMEANS_ENGINE', 'sklearn'),
+        help='K-means of the segmentation: `sklearn` on every voxel, or `histogram` on the intensity histogram, faster and exact, whose maps may differ from sklearn\'s (env: PREPROCESS_KMEANS_ENGINE)'
+    )
+    stages.add_argument(
+        '--fuse-enhance-segment', action='store_true', default=_env_flag('PREPROCESS_FUSE_ENHANCE_SEGMENT'),
+        help='Run enhancement and segmentation in one node, passing the enhanced volume in memory (env: PREPROCESS_FUSE_ENHANCE_SEGMENT)'
+    )
+    stages.add_argument(
+        '--save-enhanced', action='store_true',
+        help='With `--fuse-enhance-segment`, also save the enhanced image in the `enhancement` folder'
+    )
+    stages.add_argument(
+        '--acpc-scratch', type=_absolute_path, default=os.getenv('ACPC_SCRATCH_ROOT'),
+        help='Scratch folder acpcdetect runs in, e.g. /dev/shm, defaults to the output folder of the subject (env: ACPC_SCRATCH_ROOT)'
+    )
+    stages.add_argument(
+        '--final-mode', choices=['link', 'copy'], default=os.getenv('PREPROCESS_FINAL_MODE', 'link'),
+        help='How the files of final_output are made: `link` hardlinks them (reflink/symlink on other filesystems), `copy` copies them (env: PREPROCESS_FINAL_MODE)'
+    )
+    stages.add_argument(
+        '--qc-mosaic', action='store_true', default=_env_flag('PREPROCESS_QC_MOSAIC'),
+        help='Also save a mosaic of the ACPC aligned image along the three axes for QC (env: PREPROCESS_QC_MOSAIC)'
+    )
+    stages.add_argument(
+        '--draw-workers', type=int, default=int(os.getenv('PREPROCESS_DRAW_WORKERS', 1)),
+        help='Worker processes drawing the GM/WM/CSF maps of a subject (env: PREPROCESS_DRAW_WORKERS)'
+    )
+
+    tools = parser.add_argument_group('external tools', 'Limits of acpcdetect, fslreorient2std, flirt, bet and N4BiasFieldCorrection, defaults in utils/command_runner.py')
+    tools.add_argument(
+        '--tool-slots', type=_tool_value(int), action='append', default=[], metavar='TOOL=N',
+        help='Maximum number of runs of TOOL at once on the host, across MultiProc workers and shards, 0 for no limit (defaults: one acpcdetect and one flirt per processor, one N4BiasFieldCorrection per processor and 2 GiB of memory), repeatable'
+    )
+    tools.add_argument(
+        '--tool-timeout', type=_tool_value(float), action='append', default=[], metavar='TOOL=SECONDS',
+        help='Kill a run of TOOL after SECONDS, repeatable'
+    )
+    tools.add_argument(
+        '--tool-retries', type=_tool_value(int), action='append', default=[], metavar='TOOL=N',
+        help='Attempts of TOOL after a timeout or a kill by a signal, repeatable'
+    )
+
+def tool_limit_overrides(args:argparse.Namespace) -> dict:
+    # Limits of the external tools (see utils.command_runner), the command line on top of PREPROCESS_TOOL_LIMITS
+    overrides = json.loads(os.getenv('PREPROCESS_TOOL_LIMITS') or '{}')
+    for limit in ('slots', 'timeout', 'retries'):
+        for tool, value in getattr(args, f'tool_{limit}'):
+            overrides.setdefault(tool, {})[limit] = value
+    return overrides
+
+def registration_cache(args:argparse.Namespace):
+    # Content-addressed, so shared by all the shards of the work directory
+    if args.no_registration_cache:
+        return None
+    return args.registration_cache or (args.work_dir or args.output_dir / '.nipype') / 'flirt_cache'
+
+def node_inputs(args:argparse.Namespace) -> dict:
+    # Inputs of the workflow nodes set from the command line
+    cache_dir = registration_cache(args)
+    return {
+        't1_acpc_detect': {
+            'qc_mosaic': args.qc_mosaic,
+            **({'scratch_root': args.acpc_scratch.as_posix()} if args.acpc_scratch else {}),
+        },
+        'registration': {'profile': args.registration_profile, **({'cache_dir': cache_dir.as_posix()} if cache_dir else {})},
+        'bias_field_correction': {'profile': args.n4_profile, 'num_threads': args.n4_threads},
+        'zip_output': {'mode': args.zip_mode, 'compress_level': args.zip_level, 'num_threads': args.zip_threads},
+        'segmentation': {'kmeans_engine': args.kmeans_engine},
+        'enhance_segment': {'save_intermediate': args.save_enhanced, 'kmeans_engine': args.kmeans_engine},
+        'draw_segmentation': {'num_threads': args.draw_workers},
+        'final_output': {'mode': args.final_mode},
+    }
+
+def run(args:argparse.Namespace):
+    input_files = discover_inputs(args.input_dir, args.include or DEFAULT_INCLUDE, args.exclude)
+    total = len(input_files)
+
+    work_dir = args.work_dir or args.output_dir / '.nipype'
+    if args.shard:
+        index, count = args.shard
+        input_files = select_shard(input_files, index, count, args.shard_by)
+        # Shards run concurrently, so each one keeps its own node cache
+        work_dir = work_dir / f'shard-{index}-of-{count}'
+
+    shard = '{}/{}'.format(*args.shard) if args.shard else 'all'
+    logger.info(f'{len(input_files)} of {total} input files selected (shard: {shard})')
+
+    if args.dry_run:
+        print(f'input dir:  {args.input_dir}')
+        print(f'output dir: {args.output_dir}')
+        print(f'work dir:   {work_dir}')
+        print(f'plugin:     {args.plugin} (n_procs={args.n_procs}, memory_gb={args.memory_gb})')
+        print(f'mode:       {"incremental" if args.incremental else "clean"}')
+        print(f'fused enhance+segment: {args.fuse_enhance_segment}')
+        print(f'node inputs: {node_inputs(args)}')
+        print(f'tool limits: {tool_limit_overrides(args)}')
+        print(f'subjects:   {len(input_files)} of {total} (shard: {shard})')
+        for input_file in input_files:
+            print(f'  {subject_name(input_file)}\t{input_file}\t{args.output_dir / subject_name(input_file)}')
+        return
+
+    if not input_files:
+        logger.warning(f'No input files to process in {args.input_dir}')
+        return
+
+    process_inputs(args, input_files, work_dir, write_graph=args.write_graph)
+
+def process_inputs(args:argparse.Namespace, input_files:list, work_dir:Path, write_graph:bool=False):
+    # Build and run the workflow of `input_files` with the settings of the command line
+    # Inherited by the MultiProc workers, where the tools run
+    os.environ['PREPROCESS_TOOL_LIMITS'] = json.dumps(tool_limit_overrides(args))
+
+    # Imported here so `--help` and `--dry-run` don't pay for nipype and the node modules
+    from workflow import build_workflow, prepare_pairs, run_workflow
+
+    pairs = prepare_pairs(input_files, args.output_dir, clean=not args.incremental)
+    workflow = build_workflow(
+        pairs, work_dir, clean=not args.incremental, node_inputs=node_inputs(args),
+        fuse_enhance_segment=args.fuse_enhance_segment
+    )
+    return run_workflow(workflow, args.plugin, args.n_procs, args.memory_gb, write_graph=write_graph)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m preprocess',
+        description='Preprocessing pipeline on brain MR images'
+    )
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = subparsers.add_parser('run', help='Run the workflow on the input folder')
+    add_run_arguments(run_parser)
+    run_parser.set_defaults(func=run)
+
+    watch_parser = subparsers.add_parser('watch', help='Process the scans arriving in the input folder, until stopped')
+    add_run_arguments(watch_parser)
+    add_watch_arguments(watch_parser)
+    watch_parser.set_defaults(func=watch)
+
+    args = parser.parse_args(argv)
+    args.func(args)
@@ -0,0 +1,78 @@
+import fnmatch
+import zlib
+from pathlib import Path
+from typing import Iterable, List, Tuple
+
+from loguru import logger
+
+from utils.nii_stem import nii_stem
+
+DEFAULT_INCLUDE = ('*.nii', '*.nii.gz')
+
+def subject_name(input_file:Path) -> str:
+    # Name of the subject output folder
+    return nii_stem(input_file)
+
+def discover_inputs(input_dir:Path, include:Iterable[str]=DEFAULT_INCLUDE, exclude:Iterable[str]=()) -> List[Path]:
+    """
+    List the input files matching any `include` glob and no `exclude` pattern, sorted by path.
+
+    Args:
+    input_dir (Path): Folder holding the scans.
+    include (list): Glob patterns relative to `input_dir`, e.g. `*.nii` or `ADNI*/**/*.nii`.
+    exclude (list): `fnmatch` patterns tested against the path relative to `input_dir`.
+
+    When several files map to the same subject (`x.nii` and `x.nii.gz`),
+    only the first one is kept.
+    """
+    input_dir = Path(input_dir)
+    files = set()
+    for pattern in include:
+        files.update(path for path in input_dir.glob(pattern) if path.is_file())
+
+    input_files = {}
+    for path in sorted(files):
+        if any(fnmatch.fnmatch(path.relative_to(input_dir).as_posix(), pattern) for pattern in exclude):
+            continue
+        name = subject_name(path)
+        if name in input_files:
+            logger.warning(f'Skipping {path}: subject {name} is already read from {input_files[name]}')
+            continue
+        input_files[name] = path
+    return list(input_files.values())
+
+def parse_shard(value:str) -> Tuple[int, int]:
+    # `i/N` with 0 <= i < N, e.g. `$SLURM_ARRAY_TASK_ID/$SLURM_ARRAY_TASK_COUNT`
+    try:
+        index, count = (int(part) for part in value.split('/'))
+    except ValueError:
+        raise ValueError(f'Shard must look like i/N, got {value!r}')
+    if count < 1 or not 0 <= index < count:
+        raise ValueError(f'Shard index must be in [0, {count}), got {value!r}')
+    return index, count
+
+# How subjects are split across shards, see `select_shard`
+SHARD_METHODS = ('order', 'hash')
+
+def select_shard(input_files:List[Path], index:int, count:int, by:str='order') -> List[Path]:
+    """
+    Keep the input files of shard `index` out of `count`.
+
+    Args:
+    input_files (list): Input files of every subject.
+    index (int): Shard to keep, 0-based.
+    count (int): Number of shards.
+    by (str): `order` deals the sorted files round-robin, so the shard sizes
+        differ by at most one, but adding or removing a scan moves the
+        subjects after it to other shards. `hash` assigns a subject by a
+        hash of its name, so it always lands on the same shard (and reuses
+        that shard's node cache) whatever the other scans are, at the cost
+        of uneven shards: with 2,000 subjects over 100 shards, shards hold
+        from about 10 to 30 subjects, and a few subjects over a few shards
+        can leave a shard empty.
+    """
+    if by == 'order':
+        return sorted(input_files)[index::count]
+    if by == 'hash':
+        return [path for path in input_files if zlib.crc32(subject_name(path).encode()) % count == index]
+    raise ValueError(f'Unknown shard method: {by}')
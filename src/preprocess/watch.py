@@ -0,0 +1,187 @@
+"""
+Watch-folder service: process every scan arriving in the input folder.
+
+    python -m preprocess watch --input-dir /data --output-dir /output [options]
+
+The input folder is polled every `--poll-interval` seconds. A new (or
+modified) scan is queued once its size and modification time have not
+changed for `--settle` seconds, so files still being copied are not read.
+Queued scans are processed by a pool of `--workers` processes that import
+the pipeline's stack (nipype, nilearn, scipy...) once at startup, so a scan
+only costs its processing time. Every subject runs its own workflow, with
+its node cache in `<work-dir>/watch/<subject>`.
+
+A scan is skipped when its `final_output/manifest.json` is newer than the
+scan, so restarting the service does not process the folder again.
+
+The state of the service (queue depth, running and recent subjects) is
+written to `--status-file` after every poll.
+"""
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import json
+import multiprocessing
+import os
+from pathlib import Path
+import signal
+import time
+import traceback
+
+from loguru import logger
+
+from preprocess.subjects import DEFAULT_INCLUDE, discover_inputs, select_shard, subject_name
+
+# Finished subjects kept in the status file
+RECENT_SUBJECTS = 50
+
+def add_watch_arguments(parser:argparse.ArgumentParser):
+    watch = parser.add_argument_group('watch')
+    watch.add_argument(
+        '--poll-interval', type=float, default=float(os.getenv('PREPROCESS_POLL_INTERVAL', 5)),
+        help='Seconds between two scans of the input folder (env: PREPROCESS_POLL_INTERVAL)'
+    )
+    watch.add_argument(
+        '--settle', type=float, default=float(os.getenv('PREPROCESS_SETTLE', 10)),
+        help='Seconds a file must stay unchanged before it is processed (env: PREPROCESS_SETTLE)'
+    )
+    watch.add_argument(
+        '--workers', type=int, default=int(os.getenv('PREPROCESS_WATCH_WORKERS', 1)),
+        help='Subjects processed at once, each in a warm worker process (env: PREPROCESS_WATCH_WORKERS)'
+    )
+    watch.add_argument(
+        '--status-file', type=Path, default=os.getenv('PREPROCESS_STATUS_FILE'),
+        help='Status of the service (JSON), defaults to <work-dir>/watch_status.json (env: PREPROCESS_STATUS_FILE)'
+    )
+
+def _file_state(path:Path):
+    stat = path.stat()
+    return stat.st_size, stat.st_mtime_ns
+
+def is_processed(input_file:Path, output_dir:Path) -> bool:
+    # The manifest is written last, after every output of the subject
+    manifest_file = output_dir / subject_name(input_file) / 'final_output' / 'manifest.json'
+    try:
+        return manifest_file.stat().st_mtime_ns >= input_file.stat().st_mtime_ns
+    except FileNotFoundError:
+        return False
+
+def _warm_up():
+    # Import the pipeline's stack once per worker, before the first scan arrives.
+    # The nodes import nilearn/matplotlib/scikit-learn when they run, so they are imported here as well.
+    import workflow  # noqa: F401
+    import nilearn.plotting  # noqa: F401
+
+def _process_subject(args:argparse.Namespace, input_file:Path, work_dir:Path) -> float:
+    from preprocess.cli import process_inputs
+
+    start = time.perf_counter()
+    # Workers run concurrently, so none of them draws the graph in the shared working directory
+    process_inputs(args, [input_file], work_dir, write_graph=False)
+    return time.perf_counter() - start
+
+def write_status(status_file:Path, status:dict):
+    # Written to a temporary file then renamed, so readers never see a partial file
+    status_file.parent.mkdir(parents=True, exist_ok=True)
+    temp_file = status_file.with_name('.' + status_file.name + '.tmp')
+    temp_file.write_text(json.dumps(status, indent=2, default=str))
+    os.replace(temp_file, status_file)
+
+def watch(args:argparse.Namespace):
+    work_dir = args.work_dir or args.output_dir / '.nipype'
+    status_file = args.status_file or work_dir / 'watch_status.json'
+    include = args.include or DEFAULT_INCLUDE
+
+    # Stop polling on SIGTERM/SIGINT, then let the running subjects finish
+    stopping = False
+    def stop(signum, frame):
+        nonlocal stopping
+        logger.info('Stopping, waiting for the running subjects')
+        stopping = True
+        # The queued subjects are picked up again at the next start
+        for future in futures:
+            future.cancel()
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    settling = {}  # input file -> (size, mtime) and when it was last seen changing
+    submitted = {}  # input file -> (size, mtime) it was queued with
+    futures = {}  # future -> (input file, queued at)
+    recent = []
+    counts = {'done': 0, 'failed': 0}
+
+    def update_status():
+        # The executor hands one more task than it has workers to its call queue, where it is `running` already.
+        # Tasks run in submission order, so the running ones are the first ones.
+        running = [str(input_file) for future, (input_file, _) in futures.items() if future.running()][:args.workers]
+        write_status(status_file, {
+            'updated_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'pid': os.getpid(),
+            'stopping': stopping,
+            'settling': len(settling),
+            'queue_depth': len(futures) - len(running),
+            'running': running,
+            **counts,
+            'recent': recent[-RECENT_SUBJECTS:],
+        })
+
+    logger.info(f'Watching {args.input_dir} every {args.poll_interval} s with {args.workers} workers, status in {status_file}')
+    # Forked after the warm-up below, so the workers start with the stack imported
+    _warm_up()
+    context = multiprocessing.get_context('fork')
+    with ProcessPoolExecutor(max_workers=args.workers, mp_context=context, initializer=_warm_up) as executor:
+        while not stopping or futures:
+            if not stopping:
+                input_files = discover_inputs(args.input_dir, include, args.exclude)
+                if args.shard:
+                    # The folder grows, so a subject must stay on its shard as scans arrive
+                    input_files = select_shard(input_files, *args.shard, by='hash')
+
+                now = time.monotonic()
+                for input_file in input_files:
+                    try:
+                        state = _file_state(input_file)
+                    except FileNotFoundError:
+                        continue
+                    if submitted.get(input_file) == state:
+                        continue
+                    if input_file not in submitted and is_processed(input_file, args.output_dir):
+                        submitted[input_file] = state
+                        continue
+
+                    # Debounce: queue the file once it stopped changing for `settle` seconds
+                    previous = settling.get(input_file)
+                    if previous is None or previous[0] != state:
+                        settling[input_file] = (state, now)
+                        continue
+                    if now - previous[1] < args.settle:
+                        continue
+
+                    del settling[input_file]
+                    submitted[input_file] = state
+                    subject_work_dir = work_dir / 'watch' / subject_name(input_file)
+                    future = executor.submit(_process_subject, args, input_file, subject_work_dir)
+                    futures[future] = (input_file, time.time())
+                    logger.info(f'Queued {input_file} ({len(futures)} in the queue)')
+
+            for future in [future for future in futures if future.done()]:
+                input_file, queued_at = futures.pop(future)
+                entry = {'subject': subject_name(input_file), 'input_file': str(input_file), 'queued_at': queued_at, 'finished_at': time.time()}
+                if future.cancelled():
+                    continue
+                try:
+                    entry['elapsed_s'] = future.result()
+                    entry['status'] = 'done'
+                    counts['done'] += 1
+                    logger.info(f'Processed {input_file} in {entry["elapsed_s"]:.1f} s')
+                except Exception as e:
+                    entry['status'] = 'failed'
+                    entry['error'] = ''.join(traceback.format_exception_only(type(e), e)).strip()
+                    counts['failed'] += 1
+                    logger.error(f'Failed on {input_file}: {entry["error"]}')
+                recent.append(entry)
+
+            update_status()
+            time.sleep(args.poll_interval if not stopping else 1)
+
+    update_status()
+    logger.info('Stopped')
@@ -0,0 +1,162 @@
+"""
+Runner of the external tools of the pipeline (acpcdetect, FSL, ANTs).
+
+Every run goes through `run_command`, which:
+
+- waits for a slot of the tool across the processes of the host
+  (`utils.process_slots`), so that at most `slots` runs of a tool are
+  alive at once, whichever MultiProc worker or shard starts them,
+- kills the run (and its children) after `timeout` seconds,
+- retries transient failures (timeout, killed by a signal, e.g. by the
+  OOM killer) up to `retries` times,
+- captures stdout/stderr and times every attempt.
+
+The limits of every tool are set in `TOOL_LIMITS`, and can be overridden
+for a run with the `PREPROCESS_TOOL_LIMITS` environment variable (JSON,
+e.g. `{"N4BiasFieldCorrection": {"slots": 2}}`), which the MultiProc
+workers inherit.
+"""
+import json
+import os
+from pathlib import Path
+import shlex
+import signal
+import subprocess
+import time
+from typing import Dict, List, Union
+
+from loguru import logger
+
+from utils.process_slots import process_slot
+
+# Memory budget of one N4 run on a 1mm volume (float64 copies of the image and the B-spline lattice)
+N4_RUN_BYTES = 2 * 2 ** 30
+
+def host_slots(run_bytes:int=0) -> int:
+    # One run per processor of the host (the slots are shared by all its processes)
+    # and, with `run_bytes`, per `run_bytes` of physical memory
+    slots = os.cpu_count() or 1
+    if run_bytes:
+        slots = min(slots, os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') // run_bytes)
+    return max(1, slots)
+
+# slots: runs at once on the host (0: no limit), timeout: seconds per attempt (None: no limit),
+# retries: extra attempts after a transient failure
+TOOL_LIMITS = {
+    # Single-threaded, one run per subject overlapping under MultiProc and across shards
+    'acpcdetect': {'slots': host_slots(), 'timeout': 1800, 'retries': 1},
+    'fslreorient2std': {'slots': 0, 'timeout': 600, 'retries': 1},
+    # Single-threaded and CPU-bound, shards running side by side would oversubscribe the host
+    'flirt': {'slots': host_slots(), 'timeout': 3600, 'retries': 1},
+    'bet': {'slots': 0, 'timeout': 1800, 'retries': 1},
+    # The largest memory footprint of the pipeline
+    'N4BiasFieldCorrection': {'slots': host_slots(N4_RUN_BYTES), 'timeout': 7200, 'retries': 1},
+}
+DEFAULT_LIMITS = {'slots': 0, 'timeout': None, 'retries': 0}
+
+# Seconds before the next attempt, doubled after every failure
+RETRY_DELAY = 5.0
+
+def tool_limits(tool:str) -> dict:
+    # Read at every run, so the overrides set by the CLI reach the MultiProc workers
+    overrides = json.loads(os.getenv('PREPROCESS_TOOL_LIMITS') or '{}')
+    return {**DEFAULT_LIMITS, **TOOL_LIMITS.get(tool, {}), **overrides.get(tool, {})}
+
+def _attempt(command:Union[str, List[str]], timeout:float, cwd:str, env:dict) -> dict:
+    start = time.perf_counter()
+    # In its own session, so a timeout kills the children of the tool as well
+    process = subprocess.Popen(
+        command, shell=isinstance(command, str), stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+        cwd=cwd, env=env, start_new_session=True
+    )
+
+    timed_out = False
+    try:
+        stdout, stderr = process.communicate(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        timed_out = True
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+        stdout, stderr = process.communicate()
+
+    return {
+        'returncode': process.returncode,
+        'timed_out': timed_out,
+        'stdout': stdout.decode(errors='replace'),
+        'stderr': stderr.decode(errors='replace'),
+        'elapsed_s': time.perf_counter() - start,
+    }
+
+def run_command(command:Union[str, List[str]], tool:str, cwd:str=None, env:dict=None, retry_delay:float=RETRY_DELAY) -> dict:
+    """
+    Run `command` under the limits of `tool` (see `tool_limits`).
+
+    Args:
+    command (str or list): Shell command line, or program and arguments.
+    tool (str): Name of the tool, the key of its limits.
+    cwd (str): Working directory of the command.
+    env (dict): Environment of the command, defaults to the current one.
+    retry_delay (float): Seconds before the first retry, doubled after every failure.
+
+    Returns a dict with the `returncode`, `stdout`, `stderr` and `elapsed_s`
+    of the last attempt, and the number of `attempts`.
+    Raises RuntimeError when the command still fails after the retries.
+    """
+    limits = tool_limits(tool)
+    delay = retry_delay
+
+    for attempt in range(1, limits['retries'] + 2):
+        with process_slot(tool, limits['slots']):
+            result = _attempt(command, limits['timeout'], cwd, env)
+        result['attempts'] = attempt
+
+        if result['returncode'] == 0 and not result['timed_out']:
+            logger.info(f'{tool} finished in {result["elapsed_s"]:.1f} s')
+            return result
+
+        if result['timed_out']:
+            reason = f'timed out after {limits["timeout"]} s'
+        else:
+            reason = f'exited with status {result["returncode"]}'
+        # A timeout or a kill by a signal may pass on a less loaded host, an error exit won't
+        transient = result['timed_out'] or result['returncode'] < 0
+        if not transient or attempt > limits['retries']:
+            raise RuntimeError(f'{tool} {reason} (attempt {attempt}): {result["stderr"].strip()[-1000:]}')
+
+        logger.warning(f'{tool} {reason} (attempt {attempt}), retrying in {delay:.0f} s')
+        time.sleep(delay)
+        delay *= 2
+
+def run_nipype_command(interface, tool:str=None) -> Dict:
+    """
+    Run a nipype command-line interface (FSL, ANTs) through `run_command`, instead of `interface.run()`.
+
+    `interface.run()` starts the tool itself, with no timeout, so the
+    interface is only used to build the command: its mandatory inputs and
+    version requirements are checked as `run()` checks them, and the
+    command line and environment (e.g. `FSLOUTPUTTYPE`, `NSLOTS`) are the
+    ones nipype would use. The command runs in the current directory, where
+    nipype puts the outputs it names itself.
+
+    What `run()` records is not: there is no nipype runtime (stdout/stderr,
+    host, duration, resource monitoring) nor provenance for the tool, the
+    pre/post run hooks of the interface are not called, and outputs are
+    aggregated without the runtime, which FSL and ANTs interfaces used here
+    don't need. The node calling this function still records its own
+    runtime, and the runner logs the runtime of the tool.
+
+    Args:
+    interface (CommandLine): Interface with its inputs set.
+    tool (str): Name of the tool, defaults to the executable of the interface.
+
+    Returns the outputs of the interface.
+    """
+    interface._check_version_requirements(interface.inputs)
+    # `cmdline` checks the mandatory inputs
+    command = interface.cmdline
+    tool = tool or Path(shlex.split(interface.cmd)[0]).name
+    env = {**os.environ, **interface.inputs.environ}
+    run_command(command, tool, cwd=os.getcwd(), env=env)
+    return interface.aggregate_outputs()
@@ -1,30 +1,119 @@
-from matplotlib import pyplot as plt
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+from pathlib import Path
+import tempfile
+from typing import List
+
 import numpy as np
 
-from nilearn import image
-from nilearn.plotting import plot_stat_map
 import nibabel as nib
 
+from utils.load_nii import load_nii_image
+
+# Modules imported once by the fork server, so the drawing workers start with them
+WORKER_PRELOAD = ['matplotlib.pyplot', 'nilearn.plotting']
+
+# Background image of the maps drawn in a worker process, set by `_init_worker`
+_background = None
+
+
+def _load_background(input_nii_path:str) -> nib.Nifti1Image:
+    # Loaded in float32 rather than nibabel's default float64, then reordered
+    # to the axes of the display. nilearn reorders (resamples, when the affine
+    # is not diagonal) the background in every map it draws, and is a no-op
+    # on an image reordered already, so this is done once for all the maps.
+    from nilearn.image import reorder_img
+
+    return reorder_img(load_nii_image(input_nii_path, dtype=np.float32), resample='continuous')
+
+
+def _plot_map(bg_img:nib.Nifti1Image, input_seg_nii_path:str, output_png_path:str, threshold:float, title:str):
+    # nilearn and matplotlib are slow to import, so only the processes drawing maps import them
+    from matplotlib import pyplot as plt
+    from nilearn.plotting import plot_stat_map
+
+    seg_img = load_nii_image(input_seg_nii_path, dtype=np.float32)
+    data = np.asanyarray(seg_img.dataobj)
+
+    # Normalize the segmentation image data to 0-1, in place
+    data_min, data_max = np.min(data), np.max(data)
+    normalized_data = np.subtract(data, data_min, out=data)
+    normalized_data /= data_max - data_min
+
+    # Create a new NIfTI image with the normalized data, keeping the header of the segmentation
+    normalized_intput_seg_nii = nib.Nifti1Image(normalized_data, seg_img.affine, seg_img.header)
 
-def draw_segmentation(input_nii_path:str, input_seg_nii_path:str, output_png_path:str, threshold:float=0.6, title='Prob. map'):
-    input_nii = image.smooth_img(input_nii_path, fwhm=None)
-    intput_seg_nii = image.smooth_img(input_seg_nii_path, fwhm=None)
-    
-    # Normalize the segmentation image data to 0-1
-    data = intput_seg_nii.get_fdata()
-    normalized_data = (data - np.min(data)) / (np.max(data) - np.min(data))
-    
-    # Create a new NIfTI image with the normalized data
-    normalized_intput_seg_nii = nib.Nifti1Image(normalized_data, intput_seg_nii.affine, intput_seg_nii.header)
-      
     plot_stat_map(
         stat_map_img=normalized_intput_seg_nii,
         title=title,
         cmap=plt.cm.magma,
         threshold=threshold,
-        bg_img=input_nii, # bg_img is the background image on top of which we plot the stat_map
+        bg_img=bg_img, # bg_img is the background image on top of which we plot the stat_map
         display_mode='z',
-        cut_coords=range(-50, 50, 20),
+        cut_coords=list(range(-50, 50, 20)),
         dim=-1,
         output_file=output_png_path
-    )
\ No newline at end of file
+    )
+
+
+def _init_worker(background_path:str):
+    global _background
+    from matplotlib import pyplot as plt
+    plt.switch_backend('Agg')
+    # Memory-mapped, so the workers share the pages of the background
+    _background = nib.load(background_path, mmap=True)
+
+
+def _plot_map_in_worker(input_seg_nii_path:str, output_png_path:str, threshold:float, title:str):
+    _plot_map(_background, input_seg_nii_path, output_png_path, threshold, title)
+
+
+def draw_segmentation(input_nii_path:str, input_seg_nii_path:str, output_png_path:str, threshold:float=0.6, title='Prob. map'):
+    _plot_map(_load_background(input_nii_path), input_seg_nii_path, output_png_path, threshold, title)
+
+
+def draw_segmentations(input_nii_path:str, input_seg_nii_paths:List[str], output_png_paths:List[str], titles:List[str], threshold:float=0.6, num_workers:int=1):
+    """
+    Draw several segmentation maps on top of the same background image.
+
+    The background is loaded and reordered (resampled to the display axes)
+    once, and shared by all the maps. With `num_workers` > 1, the maps are
+    drawn in worker processes (Agg backend), started from a fork server
+    rather than forked from the caller, whose other threads (e.g. the stage
+    monitor) may hold locks. The workers memory-map the reordered background
+    from an uncompressed temporary copy, so they share its pages. The input
+    files are only memory-mapped when uncompressed (`.nii`): `.nii.gz` files
+    are decompressed into the memory of the process reading them.
+
+    Args:
+    input_nii_path (str): Background image, e.g. the ACPC aligned scan.
+    input_seg_nii_paths (list): Segmentation maps to draw.
+    output_png_paths (list): PNG file of each map.
+    titles (list): Title of each map.
+    threshold (float): Threshold of the normalized maps (0-1).
+    num_workers (int): Number of worker processes.
+    """
+    maps = list(zip(input_seg_nii_paths, output_png_paths, titles))
+    bg_img = _load_background(input_nii_path)
+
+    if num_workers <= 1 or len(maps) <= 1:
+        for input_seg_nii_path, output_png_path, title in maps:
+            _plot_map(bg_img, input_seg_nii_path, output_png_path, threshold, title)
+        return
+
+    with tempfile.TemporaryDirectory(prefix='draw-') as temp_dir:
+        background_path = (Path(temp_dir) / 'background.nii').as_posix()
+        nib.save(bg_img, background_path)
+        del bg_img
+
+        context = multiprocessing.get_context('forkserver')
+        context.set_forkserver_preload(WORKER_PRELOAD)
+        with ProcessPoolExecutor(
+            max_workers=min(num_workers, len(maps)), mp_context=context, initializer=_init_worker, initargs=(background_path,)
+        ) as executor:
+            futures = [
+                executor.submit(_plot_map_in_worker, input_seg_nii_path, output_png_path, threshold, title)
+                for input_seg_nii_path, output_png_path, title in maps
+            ]
+            for future in futures:
+                future.result()
@@ -0,0 +1,24 @@
+import hashlib
+import os
+from functools import lru_cache
+
+CHUNK_SIZE = 1 << 20
+
+@lru_cache(maxsize=64)
+def _cached_sha256(path:str, size:int, mtime_ns:int) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def file_sha256(path) -> str:
+    """
+    SHA-256 of a file's content, in hex.
+
+    Cached per process on the path, size and modification time, so a file
+    hashed for every subject (e.g. the registration template) is only read once.
+    """
+    path = os.path.realpath(path)
+    stat = os.stat(path)
+    return _cached_sha256(path, stat.st_size, stat.st_mtime_ns)
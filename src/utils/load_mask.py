@@ -0,0 +1,56 @@
+from typing import Optional
+
+import numpy as np
+
+from utils.load_nii import load_nii
+
+def load_mask(path:str) -> np.ndarray:
+    """
+    Load a binary mask (e.g. BET's `_mask` output) as the flat indices of its voxels.
+
+    Indices are in Fortran order, the on-disk order of NIfTI images, so
+    gathering voxels of a loaded image with `volume.reshape(-1, order='F')[index]`
+    doesn't copy it.
+    """
+    mask, _ = load_nii(path)
+    return np.flatnonzero(np.asarray(mask).reshape(-1, order='F'))
+
+def foreground_index(volume:np.ndarray, mask_index:Optional[np.ndarray]=None) -> np.ndarray:
+    """
+    Flat indices (Fortran order) of the voxels > 0 of `volume`.
+
+    With `mask_index` (see `load_mask`), only the voxels of the mask are
+    checked instead of the whole grid. The result is the same as long as
+    the volume is 0 outside the mask, as after skull stripping.
+    """
+    flat = volume.reshape(-1, order='F')
+    if mask_index is None:
+        return np.flatnonzero(flat > 0)
+    return mask_index[flat[mask_index] > 0]
+
+def scatter(values:np.ndarray, index:np.ndarray, shape:tuple) -> np.ndarray:
+    # Volume of `shape` holding `values` at the flat indices and 0 elsewhere
+    flat = np.zeros(int(np.prod(shape)), dtype=values.dtype)
+    flat[index] = values
+    return flat.reshape(shape, order='F')
+
+def dilate_index(mask_index:np.ndarray, shape:tuple, size:int) -> np.ndarray:
+    """
+    Flat indices (Fortran order) of the voxels within a cube of `size` centered on a voxel of the mask.
+
+    A median filter of `size` only sets voxels whose neighbourhood holds a
+    non-zero voxel, so a volume that is 0 outside the mask is still 0
+    outside the dilated mask once filtered.
+    """
+    mask = scatter(np.ones(mask_index.size, dtype=np.uint8), mask_index, shape)
+    radius = size // 2
+    # The cube is separable: a maximum over the shifted copies along every axis in turn
+    for axis in range(mask.ndim):
+        dilated = mask.copy(order='K')
+        for shift in range(1, radius + 1):
+            after = tuple(slice(shift, None) if a == axis else slice(None) for a in range(mask.ndim))
+            before = tuple(slice(None, -shift) if a == axis else slice(None) for a in range(mask.ndim))
+            np.maximum(dilated[after], mask[before], out=dilated[after])
+            np.maximum(dilated[before], mask[after], out=dilated[before])
+        mask = dilated
+    return np.flatnonzero(mask.reshape(-1, order='F'))
@@ -1,6 +1,44 @@
 import numpy as np
 import nibabel as nib
 
-def load_nii(path:str):
-    nii = nib.load(path)
-    return np.asanyarray(nii.dataobj), nii.affine
+def load_nii(path:str, dtype=None, mmap:bool=True, lazy:bool=False):
+    """
+    Load a NIfTI file, returning its data and affine.
+
+    Args:
+    path (str): Path to the NIfTI file (.nii or .nii.gz).
+    dtype (np.dtype): Data type of the returned array, e.g. `np.float32`. By default the on-disk type is kept (int16, uint8, ...), or float64 if the file has scaling factors.
+    mmap (bool): Memory-map uncompressed `.nii` files (copy-on-write) instead of reading them into memory. `.nii.gz` files are decompressed into memory whatever this is, so it saves nothing for them.
+    lazy (bool): Return nibabel's array proxy instead of an array, so only the indexed part is read, e.g. `data[..., 90]`. For `.nii.gz` files, the stream is still decompressed up to that part.
+    """
+    nii = nib.load(path, mmap=mmap)
+    if lazy:
+        return nii.dataobj, nii.affine
+    return _load_data(nii, dtype), nii.affine
+
+def load_nii_image(path:str, dtype=None, mmap:bool=True) -> nib.Nifti1Image:
+    """
+    Load a NIfTI file as an image holding its data, like `load_nii`, with the
+    header of the file (qform/sform codes, units...) rather than a default one.
+
+    Args:
+    path (str): Path to the NIfTI file (.nii or .nii.gz).
+    dtype (np.dtype): Data type of the data, see `load_nii`.
+    mmap (bool): Memory-map uncompressed `.nii` files, see `load_nii`.
+    """
+    nii = nib.load(path, mmap=mmap)
+    data = _load_data(nii, dtype)
+    header = nii.header.copy()
+    # The data is scaled already
+    header.set_data_dtype(data.dtype)
+    header.set_slope_inter(1, 0)
+    return nib.Nifti1Image(data, nii.affine, header)
+
+def _load_data(nii:nib.Nifti1Image, dtype) -> np.ndarray:
+    if dtype is not None and np.issubdtype(dtype, np.floating):
+        # Scaled straight to `dtype`, without a float64 copy nor caching it in the image
+        return nii.get_fdata(dtype=dtype, caching='unchanged')
+    data = np.asanyarray(nii.dataobj)
+    if dtype is not None:
+        data = data.astype(dtype, copy=False)
+    return data
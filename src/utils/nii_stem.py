@@ -0,0 +1,12 @@
+from pathlib import Path
+
+# NIfTI file extensions, FSL and ANTs read both
+NIFTI_EXTENSIONS = ('.nii.gz', '.nii')
+
+def nii_stem(path) -> str:
+    # File name without its NIfTI extension (`x.nii.gz` -> `x`)
+    name = Path(path).name
+    for extension in NIFTI_EXTENSIONS:
+        if name.endswith(extension):
+            return name[:-len(extension)]
+    return Path(path).stem
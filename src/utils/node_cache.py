@@ -0,0 +1,32 @@
+from datetime import datetime, timezone
+from typing import List, Tuple
+
+def utc_now() -> datetime:
+    return datetime.now(timezone.utc)
+
+def split_cached_nodes(graph, started_at:datetime) -> Tuple[List[str], List[str]]:
+    """
+    Split the nodes of an executed graph into reused and recomputed ones.
+
+    Args:
+    graph (networkx.DiGraph): Execution graph returned by `Workflow.run()`.
+    started_at (datetime): Time the run started, see `utc_now`.
+
+    A node whose stored result started before `started_at` was collected
+    from nipype's cache instead of being run again.
+    """
+    reused, recomputed = [], []
+    for node in graph.nodes():
+        try:
+            start_time = datetime.fromisoformat(node.result.runtime.startTime)
+        except (AttributeError, FileNotFoundError, TypeError, ValueError):
+            # No usable result file, e.g. the node crashed
+            continue
+        # Older nipype versions store naive UTC times
+        if start_time.tzinfo is None:
+            start_time = start_time.replace(tzinfo=timezone.utc)
+        if start_time < started_at:
+            reused.append(node.fullname)
+        else:
+            recomputed.append(node.fullname)
+    return reused, recomputed
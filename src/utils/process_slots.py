@@ -0,0 +1,47 @@
+from contextlib import contextmanager
+import fcntl
+import os
+from pathlib import Path
+import tempfile
+import time
+from typing import IO, Optional
+
+# Host-local folder of the slot lock files, shared by every worker and shard running on the host
+SLOTS_DIR = Path(os.getenv('PREPROCESS_SLOTS_DIR', Path(tempfile.gettempdir()) / 'preprocess-slots'))
+
+def try_acquire_slot(name:str, slots:int, slots_dir:Path=SLOTS_DIR) -> Optional[IO]:
+    """
+    Take a free slot of `name` without waiting.
+
+    A slot is an exclusive `flock` on `<slots_dir>/<name>.<i>.lock`, so at
+    most `slots` holders exist at once across all the processes of the host
+    (MultiProc workers, concurrent shards). The lock is released by closing
+    the returned file, or by the kernel if the process dies.
+
+    Returns the locked file, or None when every slot is taken.
+    """
+    Path(slots_dir).mkdir(parents=True, exist_ok=True)
+    for i in range(slots):
+        lock_file = open(Path(slots_dir) / f'{name}.{i}.lock', 'a')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.close()
+            continue
+        return lock_file
+    return None
+
+@contextmanager
+def process_slot(name:str, slots:int, slots_dir:Path=SLOTS_DIR, poll_interval:float=0.2):
+    """
+    Hold one of `slots` slots of `name` (see `try_acquire_slot`) while the block runs.
+
+    Blocks until a slot is free. With `slots` 0 or less, there is no limit.
+    """
+    if slots <= 0:
+        yield
+        return
+    while (lock_file := try_acquire_slot(name, slots, slots_dir)) is None:
+        time.sleep(poll_interval)
+    with lock_file:
+        yield
@@ -0,0 +1,96 @@
+import csv
+import json
+from pathlib import Path
+from typing import Dict, Iterable, List
+
+from loguru import logger
+
+METRICS = ('wall_time_s', 'cpu_time_s', 'peak_rss_mb', 'read_bytes', 'write_bytes')
+
+def collect_stage_metrics(graph, reused_nodes:Iterable[str]=()) -> List[Dict]:
+    """
+    Collect the metrics recorded by `InstrumentedInterface` from an executed graph.
+
+    Args:
+    graph (networkx.DiGraph): Execution graph returned by `Workflow.run()`.
+    reused_nodes (list): Full names of the nodes collected from the cache, see `split_cached_nodes`.
+
+    Returns one record per node and subject. The metrics of a reused node are the ones of the run that computed it.
+    """
+    reused_nodes = set(reused_nodes)
+    records = []
+    for node in graph.nodes():
+        try:
+            result = node.result
+            metrics = result.runtime.stage_metrics
+        except (AttributeError, FileNotFoundError, TypeError):
+            # Not instrumented (e.g. a Function node) or no result file
+            continue
+        output_folder = (result.inputs or {}).get('output_folder')
+        records.append({
+            'subject': Path(output_folder).name if output_folder else '',
+            'stage': node.name,
+            'reused': node.fullname in reused_nodes,
+            **{name: metrics.get(name) for name in METRICS},
+        })
+    return sorted(records, key=lambda record: (record['subject'], record['stage']))
+
+def summarize_stages(records:List[Dict]) -> List[Dict]:
+    """
+    Aggregate the records per stage, the slowest stage (total wall time) first.
+    """
+    stages = {}
+    for record in records:
+        stage = stages.setdefault(record['stage'], {
+            'stage': record['stage'], 'runs': 0, 'reused': 0,
+            'total_wall_s': 0.0, 'max_wall_s': 0.0, 'total_cpu_s': 0.0,
+            'max_rss_mb': 0.0, 'read_mb': 0.0, 'write_mb': 0.0,
+        })
+        stage['runs'] += 1
+        stage['reused'] += record['reused']
+        stage['total_wall_s'] += record['wall_time_s'] or 0
+        stage['max_wall_s'] = max(stage['max_wall_s'], record['wall_time_s'] or 0)
+        stage['total_cpu_s'] += record['cpu_time_s'] or 0
+        stage['max_rss_mb'] = max(stage['max_rss_mb'], record['peak_rss_mb'] or 0)
+        stage['read_mb'] += (record['read_bytes'] or 0) / 2 ** 20
+        stage['write_mb'] += (record['write_bytes'] or 0) / 2 ** 20
+
+    summary = sorted(stages.values(), key=lambda stage: stage['total_wall_s'], reverse=True)
+    for stage in summary:
+        stage['mean_wall_s'] = stage['total_wall_s'] / stage['runs']
+    return summary
+
+def format_summary(summary:List[Dict]) -> str:
+    header = f"{'stage':<24}{'runs':>6}{'reused':>8}{'total s':>10}{'mean s':>9}{'max s':>9}{'cpu s':>10}{'rss MB':>9}{'read MB':>10}{'write MB':>10}"
+    rows = [header, '-' * len(header)]
+    for stage in summary:
+        rows.append(
+            f"{stage['stage']:<24}{stage['runs']:>6}{stage['reused']:>8}"
+            f"{stage['total_wall_s']:>10.1f}{stage['mean_wall_s']:>9.1f}{stage['max_wall_s']:>9.1f}"
+            f"{stage['total_cpu_s']:>10.1f}{stage['max_rss_mb']:>9.0f}{stage['read_mb']:>10.1f}{stage['write_mb']:>10.1f}"
+        )
+    return '\n'.join(rows)
+
+def write_run_report(graph, report_folder:Path, reused_nodes:Iterable[str]=()) -> List[Dict]:
+    """
+    Write `run_report.json` and `run_report.csv` with the metrics of every stage and subject, and log a per-stage summary.
+
+    Args:
+    graph (networkx.DiGraph): Execution graph returned by `Workflow.run()`.
+    report_folder (Path): Folder of the report files.
+    reused_nodes (list): Full names of the nodes collected from the cache.
+    """
+    records = collect_stage_metrics(graph, reused_nodes)
+    summary = summarize_stages(records)
+
+    report_folder = Path(report_folder)
+    report_folder.mkdir(parents=True, exist_ok=True)
+    with open(report_folder / 'run_report.json', 'w') as f:
+        json.dump({'stages': summary, 'records': records}, f, indent=2)
+    with open(report_folder / 'run_report.csv', 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=['subject', 'stage', 'reused', *METRICS])
+        writer.writeheader()
+        writer.writerows(records)
+
+    logger.info(f'Run report: {report_folder / "run_report.json"}\n{format_summary(summary)}')
+    return records
@@ -1,5 +1,28 @@
+import numpy as np
 import nibabel as nib
 
-def save_nii(data, path, affine):
-    nib.save(nib.Nifti1Image(data, affine), path)
-    return
\ No newline at end of file
+def minimal_dtype(data:np.ndarray) -> np.dtype:
+    """
+    Smallest on-disk dtype that stores `data` without loss or scaling.
+
+    Boolean and integer volumes (masks, labels, quantized images) use the
+    first of uint8/int16/int32 that holds their range (the types every
+    FSL/ANTs tool reads); floating point volumes keep their precision.
+    """
+    if data.dtype == np.bool_:
+        return np.dtype(np.uint8)
+    if np.issubdtype(data.dtype, np.integer):
+        low, high = (int(data.min()), int(data.max())) if data.size else (0, 0)
+        for dtype in (np.uint8, np.int16, np.int32):
+            info = np.iinfo(dtype)
+            if info.min <= low and high <= info.max:
+                return np.dtype(dtype)
+    return data.dtype
+
+def save_nii(data, path, affine, dtype=None):
+    if data.dtype == np.bool_:
+        data = data.view(np.uint8)
+    # The data fits the on-disk type as is, so nibabel stores no intensity scaling
+    nii = nib.Nifti1Image(data, affine, dtype=dtype or minimal_dtype(data))
+    nib.save(nii, path)
+    return
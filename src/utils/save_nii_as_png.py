@@ -1,20 +1,38 @@
-import nibabel as nib
-import matplotlib.pyplot as plt
+from typing import Sequence, Tuple
+
+import numpy as np
 
 from loguru import logger
 
 from utils.load_nii import load_nii
+from utils.write_png import write_png
+
+def _window(data:np.ndarray, low:float, high:float) -> np.ndarray:
+    # Map [low, high] to 0-255, as matplotlib's gray colormap does with vmin/vmax
+    scale = 255 / (high - low) if high > low else 0
+    scaled = (np.asarray(data, dtype=np.float32) - low) * scale
+    return np.clip(scaled, 0, 255, out=scaled).round().astype(np.uint8)
 
-def save_nii_as_png(nii_path, png_path):
+def _to_image(selected_slice:np.ndarray) -> np.ndarray:
+    # Same orientation as `imshow(slice.T, origin='lower')`: first axis left to right, second axis bottom to top
+    return selected_slice.T[::-1]
+
+def save_nii_as_png(nii_path, png_path, percentiles:Tuple[float, float]=(0, 100)):
     """
     Save a slice of a NIfTI file as a PNG image.
 
+    Only the middle slice along the first axis is used, windowed to the
+    `percentiles` of its intensities (min-max by default), and written
+    with one pixel per voxel.
+
     Args:
     nii_path (str): Path to the NIfTI file.
     png_path (str): Path where the PNG file will be saved.
+    percentiles (tuple): Low and high percentiles of the intensity window.
     """
 
-    # Load the NIfTI file
+    # Memory-map the NIfTI file, only the pages of the selected slice are read.
+    # Slicing nibabel's array proxy instead costs one read per voxel row along the first axis.
     data, _ = load_nii(nii_path)
 
     # The data shape should be (slice_index, w, h, channels)
@@ -27,9 +45,41 @@ def save_nii_as_png(nii_path, png_path):
     selected_slice = selected_slice.squeeze()
 
     # Save the slice as a PNG file
-    plt.imshow(selected_slice.T, cmap="gray", origin="lower")
-    plt.axis('off')
-    plt.savefig(png_path, bbox_inches='tight', pad_inches=0)
-    plt.close()
+    low, high = np.percentile(selected_slice, percentiles)
+    write_png(_to_image(_window(selected_slice, low, high)), png_path)
 
     logger.info(f"Saved PNG file to {png_path}")
+
+def save_nii_mosaic_as_png(nii_path, png_path, n_slices:int=5, percentiles:Tuple[float, float]=(0.5, 99.5), margin:Sequence[float]=(0.2, 0.8)):
+    """
+    Save a QC mosaic of a NIfTI file as a PNG image: one row of slices per axis (sagittal, coronal, axial for RAS images).
+
+    Args:
+    nii_path (str): Path to the NIfTI file.
+    png_path (str): Path where the PNG file will be saved.
+    n_slices (int): Number of slices per axis, evenly spaced.
+    percentiles (tuple): Low and high percentiles of the intensity window, over the whole volume.
+    margin (tuple): Fraction of each axis covered by the slices.
+    """
+    data, _ = load_nii(nii_path)
+    data = data.squeeze()
+    # A 1/8 subsample is enough to place the window
+    low, high = np.percentile(data[::2, ::2, ::2], percentiles)
+
+    rows = []
+    for axis in range(3):
+        indices = np.linspace(margin[0], margin[1], n_slices) * (data.shape[axis] - 1)
+        # Basic indexing, so only the slices are read from the memory map
+        panels = [_to_image(data[(slice(None),) * axis + (int(round(index)),)]) for index in indices]
+        rows.append(np.concatenate(panels, axis=1))
+
+    # The rows differ in width, so they are left-aligned on a canvas of the lowest intensity
+    mosaic = np.zeros((sum(row.shape[0] for row in rows), max(row.shape[1] for row in rows)), dtype=np.float32)
+    mosaic[:] = low
+    top = 0
+    for row in rows:
+        mosaic[top:top + row.shape[0], :row.shape[1]] = row
+        top += row.shape[0]
+    write_png(_window(mosaic, low, high), png_path)
+
+    logger.info(f"Saved mosaic PNG file to {png_path}")
@@ -0,0 +1,121 @@
+import os
+import resource
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Optional, Set
+
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+
+def _read_io_counters() -> Optional[Dict[str, int]]:
+    # Bytes this process and its reaped children fetched from / sent to the storage (Linux only).
+    # Not `rchar`/`wchar`, which count every read() and write(), e.g. of the sampler scanning /proc or of pipes.
+    try:
+        fields = dict(line.split(': ') for line in Path('/proc/self/io').read_text().splitlines())
+    except (OSError, ValueError):
+        return None
+    return {'read_bytes': int(fields['read_bytes']), 'write_bytes': int(fields['write_bytes'])}
+
+def _tree_rss(root_pid:int) -> Dict[int, int]:
+    # Resident memory (bytes) of `root_pid` and of each of its descendants, from /proc
+    parents, rss = {}, {}
+    for entry in os.scandir('/proc'):
+        if not entry.name.isdigit():
+            continue
+        try:
+            # The command name may contain spaces, the fields after it don't
+            stat = Path(entry.path, 'stat').read_text().rsplit(')', 1)[1].split()
+            pages = int(Path(entry.path, 'statm').read_text().split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        pid = int(entry.name)
+        parents[pid] = int(stat[1])
+        rss[pid] = pages * PAGE_SIZE
+
+    tree = {}
+    for pid in rss:
+        ancestor = pid
+        while ancestor not in (root_pid, 0, 1) and ancestor in parents:
+            ancestor = parents[ancestor]
+        if ancestor == root_pid or pid == root_pid:
+            tree[pid] = rss[pid]
+    return tree
+
+def _tree_rss_bytes(root_pid:int, exclude:Set[int]=frozenset()) -> int:
+    # Resident memory of `root_pid` and its descendants, except the `exclude` ones (their own children are counted)
+    return sum(size for pid, size in _tree_rss(root_pid).items() if pid not in exclude)
+
+class StageMonitor:
+    """
+    Measure the resources used by a block of code, including its child processes.
+
+    Records wall time, CPU time (user + system, of this process and of the
+    children it waited for, e.g. FLIRT, BET, N4 or acpcdetect), peak resident
+    memory of the process tree (sampled from /proc every `interval` seconds,
+    and completed with the peak of reaped children) and bytes read/written
+    from/to the storage.
+
+    The descendants alive when the block starts (e.g. a fork server or
+    resource tracker left by an earlier stage) are not counted in its peak
+    memory, the processes they start during the block are.
+
+        with StageMonitor() as monitor:
+            ...
+        monitor.metrics  # {'wall_time_s': ..., 'cpu_time_s': ..., ...}
+    """
+
+    def __init__(self, interval:float=0.2):
+        self.interval = interval
+        self.metrics = {}
+        self._stop = threading.Event()
+        self._peak_rss = 0
+
+    def _sample(self):
+        pid = os.getpid()
+        while True:
+            try:
+                self._peak_rss = max(self._peak_rss, _tree_rss_bytes(pid, self._previous_pids))
+            except OSError:
+                return
+            if self._stop.wait(self.interval):
+                return
+
+    def __enter__(self):
+        self._start_wall = time.perf_counter()
+        self._start_times = os.times()
+        self._start_io = _read_io_counters()
+        self._start_children_maxrss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+        if os.path.isdir('/proc'):
+            self._previous_pids = set(_tree_rss(os.getpid())) - {os.getpid()}
+            self._sampler = threading.Thread(target=self._sample, daemon=True)
+            self._sampler.start()
+        else:
+            self._sampler = None
+        return self
+
+    def __exit__(self, *exc_info):
+        wall_time = time.perf_counter() - self._start_wall
+        times = os.times()
+        self._stop.set()
+        if self._sampler is not None:
+            self._sampler.join()
+
+        cpu_time = sum(times[:4]) - sum(self._start_times[:4])
+
+        # ru_maxrss is in KiB and only grows, so a change means a child of this stage set it
+        peak_rss = self._peak_rss
+        children_maxrss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+        if children_maxrss > self._start_children_maxrss:
+            peak_rss = max(peak_rss, children_maxrss * 1024)
+        if not peak_rss:
+            peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+        io = _read_io_counters()
+        self.metrics = {
+            'wall_time_s': round(wall_time, 3),
+            'cpu_time_s': round(cpu_time, 3),
+            'peak_rss_mb': round(peak_rss / 2 ** 20, 1),
+            'read_bytes': io['read_bytes'] - self._start_io['read_bytes'] if io and self._start_io else None,
+            'write_bytes': io['write_bytes'] - self._start_io['write_bytes'] if io and self._start_io else None,
+        }
+        return False
@@ -0,0 +1,29 @@
+import struct
+import zlib
+
+import numpy as np
+
+def _chunk(tag:bytes, data:bytes) -> bytes:
+    return struct.pack('>I', len(data)) + tag + data + struct.pack('>I', zlib.crc32(tag + data))
+
+def write_png(image:np.ndarray, png_path:str, compress_level:int=6):
+    """
+    Write a 2D uint8 array as an 8-bit grayscale PNG file, row 0 at the top.
+
+    Args:
+    image (np.ndarray): Image of shape (height, width), dtype uint8.
+    png_path (str): Path where the PNG file will be saved.
+    compress_level (int): zlib compression level (0-9).
+    """
+    image = np.ascontiguousarray(image, dtype=np.uint8)
+    height, width = image.shape
+    # Every row starts with its filter type, 0 (none)
+    rows = np.zeros((height, width + 1), dtype=np.uint8)
+    rows[:, 1:] = image
+
+    header = struct.pack('>IIBBBBB', width, height, 8, 0, 0, 0, 0)
+    with open(png_path, 'wb') as f:
+        f.write(b'\x89PNG\r\n\x1a\n')
+        f.write(_chunk(b'IHDR', header))
+        f.write(_chunk(b'IDAT', zlib.compress(rows.tobytes(), compress_level)))
+        f.write(_chunk(b'IEND', b''))
@@ -1,6 +1,9 @@
 from pathlib import Path
 import shutil
+import sys
+from typing import Dict, List, Optional, Tuple
 
+from loguru import logger
 from nipype import Function
 from nipype.pipeline import Node, Workflow
 
@@ -12,10 +15,28 @@ from node.skull_stripping.interface import SkullStrippingInterface
 from node.bias_field_correction.interface import BiasFieldCorrectionInterface
 from node.enhancement.interface import EnhancementInterface
 from node.segmentation.interface import SegmentationInterface
-from node.draw_segmentation.interface import DrawSegmentationInterface
+from node.enhance_segment.interface import EnhanceSegmentInterface
+from node.draw_segmentation.interface import DrawSegmentationMapsInterface
 from node.final_output.interface import OrganizeFinalOutputInterface
 
-from utils.convert_dot_to_png import convert_dot_to_png
+from preprocess.subjects import subject_name
+
+from utils.node_cache import split_cached_nodes, utc_now
+from utils.run_report import write_run_report
+
+# Per-subject resource estimates of each node, used by MultiProc to pack
+# subjects on a machine without running out of memory. Nodes not listed
+# use nipype's default (0.2 GB, 1 processor).
+NODE_RESOURCES = {
+    't1_acpc_detect': {'mem_gb': 0.5, 'n_procs': 1},
+    'registration': {'mem_gb': 1.0, 'n_procs': 1},
+    'skull_stripping': {'mem_gb': 0.5, 'n_procs': 1},
+    'bias_field_correction': {'mem_gb': 1.5, 'n_procs': 1},
+    'enhancement': {'mem_gb': 0.5, 'n_procs': 1},
+    'segmentation': {'mem_gb': 1.0, 'n_procs': 1},
+    'enhance_segment': {'mem_gb': 1.0, 'n_procs': 1},
+    'draw_segmentation': {'mem_gb': 0.8, 'n_procs': 1},
+}
 
 # ==========================================
 
@@ -23,28 +44,31 @@ from utils.convert_dot_to_png import convert_dot_to_png
 # Pepare the data
 # ==========================================
 
-# Define the input file and output folder
-# List of input NIfTI files to process
-data_folder = Path('/data')
-output_folder = Path('/output')
-
-input_files = []
-for file in data_folder.glob('*.nii'):
-    input_files.append(file)
-
-output_folders = []
-for input_file in input_files:
-    folder = output_folder / input_file.stem
-    folder.mkdir(parents=True, exist_ok=True)
-    output_folders.append(folder)
-    # Clean the folder
-    for file in folder.glob('*'):
-        if file.is_file():
-            file.unlink()
-        if file.is_dir():
-            shutil.rmtree(file)
-
-pairs = list(zip(input_files, output_folders))
+def prepare_pairs(input_files:List[Path], output_folder:Path, clean:bool=True) -> List[Tuple[Path, Path]]:
+    """
+    Pair every input file with its output folder, creating the folder.
+
+    Args:
+    input_files (list): Input NIfTI files.
+    output_folder (Path): Root output folder, one subfolder per subject.
+    clean (bool): Remove the previous outputs of the subjects.
+    """
+    output_folders = []
+    for input_file in input_files:
+        folder = output_folder / subject_name(input_file)
+        folder.mkdir(parents=True, exist_ok=True)
+        output_folders.append(folder)
+        # In incremental mode the outputs are kept so nipype's cache can be reused
+        if not clean:
+            continue
+        # Clean the folder
+        for file in folder.glob('*'):
+            if file.is_file():
+                file.unlink()
+            if file.is_dir():
+                shutil.rmtree(file)
+
+    return list(zip(input_files, output_folders))
 
 # ==========================================
 
@@ -57,144 +81,190 @@ def process_pair(pair):
     input_file, output_folder = pair
     return input_file, output_folder
 
-process_pair_node = Node(
-    Function(
-        input_names=["pair"],
-        output_names=["input_file", "output_folder"],
-        function=process_pair
-    ),
-    name="process_pair"
-)
-process_pair_node.iterables = [('pair', pairs)]
+def build_workflow(pairs:List[Tuple[Path, Path]], work_dir:Path, clean:bool=True, node_inputs:Optional[Dict[str, dict]]=None, fuse_enhance_segment:bool=False) -> Workflow:
+    """
+    Build the preprocessing workflow iterating over (input file, output folder) pairs.
+
+    Args:
+    pairs (list): Pairs returned by `prepare_pairs`.
+    work_dir (Path): Persistent nipype working directory holding the node cache.
+    clean (bool): Drop the node cache, so every node is recomputed.
+    node_inputs (dict): Extra inputs per node name, e.g. `{'zip_output': {'mode': 'link'}}`.
+    fuse_enhance_segment (bool): Run enhancement and segmentation in one `enhance_segment` node, handing the enhanced volume over in memory.
+    """
+    process_pair_node = Node(
+        Function(
+            input_names=["pair"],
+            output_names=["input_file", "output_folder"],
+            function=process_pair
+        ),
+        name="process_pair"
+    )
+    process_pair_node.iterables = [('pair', pairs)]
+
+    # Create the acpc node
+    acpc_node = Node(ACPCDetectInterface(), name='t1_acpc_detect', **NODE_RESOURCES['t1_acpc_detect'])
+
+    # Create the zip node
+    zip_node = Node(ZipOutputInterface(), name='zip_output')
+
+    # Create the orient2std node
+    orient2std_node = Node(Reorient2StdInterface(), name='orient2std')
+
+    # Create the registration node
+    registration_node = Node(FLIRTInterface(), name='registration', **NODE_RESOURCES['registration'])
+
+    # Create the skull stripping node
+    skull_stripping_node = Node(SkullStrippingInterface(), name='skull_stripping', **NODE_RESOURCES['skull_stripping'])
+
+    # Create the bias field correction node
+    bias_field_correction_node = Node(BiasFieldCorrectionInterface(), name='bias_field_correction', **NODE_RESOURCES['bias_field_correction'])
+
+    if fuse_enhance_segment:
+        # Create the fused enhancement and segmentation node
+        enhancement_node = None
+        segmentation_node = Node(EnhanceSegmentInterface(), name='enhance_segment', **NODE_RESOURCES['enhance_segment'])
+    else:
+        # Create the enhancement node
+        enhancement_node = Node(EnhancementInterface(), name='enhancement', **NODE_RESOURCES['enhancement'])
+
+        # Create the segmentation node
+        segmentation_node = Node(SegmentationInterface(), name='segmentation', **NODE_RESOURCES['segmentation'])
+
+    # Create the draw segmentation node, drawing the GM, WM and CSF maps
+    draw_segmentation_node = Node(DrawSegmentationMapsInterface(), name='draw_segmentation', **NODE_RESOURCES['draw_segmentation'])
+
+    # Create the final output node
+    final_output_node = Node(OrganizeFinalOutputInterface(), name='final_output')
+
+    # Create a workflow and connect the nodes
+    workflow = Workflow(name='preprocess_workflow', base_dir=Path(work_dir).as_posix())
+    nodes = [
+        process_pair_node,
+        acpc_node,
+        zip_node,
+        orient2std_node,
+        registration_node,
+        skull_stripping_node,
+        bias_field_correction_node,
+        enhancement_node,
+        segmentation_node,
+        draw_segmentation_node,
+        final_output_node,
+    ]
+    nodes = [node for node in nodes if node is not None]
+    workflow.add_nodes(nodes)
+
+    # Set the node options given by the caller
+    for node in nodes:
+        for name, value in (node_inputs or {}).get(node.name, {}).items():
+            setattr(node.inputs, name, value)
+            # Let MultiProc account for the threads/processes of the node
+            if name == 'num_threads':
+                node.n_procs = value
+
+    # Connect the input_file_node to the acpc_node (input_file & output_folder)
+    workflow.connect(process_pair_node, 'input_file', acpc_node, 'input_file')
+    workflow.connect(process_pair_node, 'output_folder', acpc_node, 'output_folder')
+
+    # Connect the acpc_node to the zip_node (input_file & output_folder)
+    workflow.connect(acpc_node, 'output_file', zip_node, 'input_file')
+    workflow.connect(process_pair_node, 'output_folder', zip_node, 'output_folder')
+
+    # Connect the zip_node to the orient2std_node (input_file & output_folder)
+    workflow.connect(zip_node, 'output_file', orient2std_node, 'input_file')
+    workflow.connect(process_pair_node, 'output_folder', orient2std_node, 'output_folder')
+
+    # Connect the orient2std_node to the registration_node (input_file & output_folder)
+    workflow.connect(orient2std_node, 'output_file', registration_node, 'input_file')
+    workflow.connect(process_pair_node, 'output_folder', registration_node, 'output_folder')
+
+    # Connect the registration_node to the skull_stripping_node (input_file & output_folder)
+    workflow.connect(registration_node, 'output_file', skull_stripping_node, 'input_file')
+    workflow.connect(process_pair_node, 'output_folder', skull_stripping_node, 'output_folder')
+
+    # Connect the skull_stripping_node to the bias_field_correction_node (input_file, mask_file & output_folder)
+    workflow.connect(skull_stripping_node, 'output_file', bias_field_correction_node, 'input_file')
+    workflow.connect(skull_stripping_node, 'mask_file', bias_field_correction_node, 'mask_file')
+    workflow.connect(process_pair_node, 'output_folder', bias_field_correction_node, 'output_folder')
+
+    if fuse_enhance_segment:
+        # Connect the bias_field_correction_node and the skull_stripping_node to the fused segmentation_node (input_file, mask_file & output_folder)
+        workflow.connect(bias_field_correction_node, 'output_file', segmentation_node, 'input_file')
+        workflow.connect(skull_stripping_node, 'mask_file', segmentation_node, 'mask_file')
+        workflow.connect(process_pair_node, 'output_folder', segmentation_node, 'output_folder')
+    else:
+        # Connect the bias_field_correction_node and the skull_stripping_node to the enhancement_node (input_file, mask_file & output_folder)
+        workflow.connect(bias_field_correction_node, 'output_file', enhancement_node, 'input_file')
+        workflow.connect(skull_stripping_node, 'mask_file', enhancement_node, 'mask_file')
+        workflow.connect(process_pair_node, 'output_folder', enhancement_node, 'output_folder')
+
+        # Connect the enhancement_node to the segmentation_node (input_file, mask_file & output_folder)
+        workflow.connect(enhancement_node, 'output_file', segmentation_node, 'input_file')
+        workflow.connect(enhancement_node, 'mask_file', segmentation_node, 'mask_file')
+        workflow.connect(process_pair_node, 'output_folder', segmentation_node, 'output_folder')
+
+    # Connect acpc_node and segmentation_node to draw_segmentation_node (input_file, GM/WM/CSF maps & output_folder)
+    workflow.connect(acpc_node, 'output_file', draw_segmentation_node, 'acpc_input_file')
+    workflow.connect(segmentation_node, 'gm_segmented_output_file', draw_segmentation_node, 'gm_segmented_input_file')
+    workflow.connect(segmentation_node, 'wm_segmented_output_file', draw_segmentation_node, 'wm_segmented_input_file')
+    workflow.connect(segmentation_node, 'csf_segmented_output_file', draw_segmentation_node, 'csf_segmented_input_file')
+    workflow.connect(process_pair_node, 'output_folder', draw_segmentation_node, 'output_folder')
+
+    # Connect the process_pair_node to the final_output_node (output_folder)
+    workflow.connect(process_pair_node, 'output_folder', final_output_node, 'output_folder')
+    # Connect the draw_gm_segmentation_node to the final_output_node (acpc_output_file & acpc_output_png)
+    workflow.connect(acpc_node, 'output_file', final_output_node, 'acpc_output_file')
+    workflow.connect(acpc_node, 'output_png_file', final_output_node, 'acpc_output_png_file')
+    # Connect the draw_segmentation_node to the final_output_node (gm_png_file, wm_png_file & csf_png_file)
+    workflow.connect(draw_segmentation_node, 'gm_output_file', final_output_node, 'gm_png_file')
+    workflow.connect(draw_segmentation_node, 'wm_output_file', final_output_node, 'wm_png_file')
+    workflow.connect(draw_segmentation_node, 'csf_output_file', final_output_node, 'csf_png_file')
+
+    # Drop the node cache as well, so every node is recomputed
+    if clean:
+        shutil.rmtree(Path(work_dir) / workflow.name, ignore_errors=True)
+
+    return workflow
 
-# Create the acpc node
-acpc_node = Node(ACPCDetectInterface(), name='t1_acpc_detect')
-
-# Create the zip node
-zip_node = Node(ZipOutputInterface(), name='zip_output')
-
-# Create the orient2std node
-orient2std_node = Node(Reorient2StdInterface(), name='orient2std')
+# ==========================================
 
-# Create the registration node
-registration_node = Node(FLIRTInterface(), name='registration')
+# ==========================================
+# Draw the workflow and run it
+# ==========================================
 
-# Create the skull stripping node
-skull_stripping_node = Node(SkullStrippingInterface(), name='skull_stripping')
+def run_workflow(workflow:Workflow, plugin:str='Linear', n_procs:Optional[int]=None, memory_gb:Optional[float]=None, write_graph:bool=False):
+    if write_graph:
+        # pydot and graphviz are only needed to draw the graph
+        from utils.convert_dot_to_png import convert_dot_to_png
 
-# Create the bias field correction node
-bias_field_correction_node = Node(BiasFieldCorrectionInterface(), name='bias_field_correction')
+        # Draw the workflow in the current directory
+        workflow.write_graph(dotfilename='./graph.dot', graph2use='flat', format='png', simple_form=True)
 
-# Create the enhancement node
-enhancement_node = Node(EnhancementInterface(), name='enhancement')
+        # Convert the detailed dot file to a png file
+        convert_dot_to_png('./graph_detailed.dot', './graph_detailed.png')
 
-# Create the segmentation node
-segmentation_node = Node(SegmentationInterface(), name='segmentation')
+    # Run the workflow
+    plugin_args = {}
+    if n_procs:
+        plugin_args['n_procs'] = n_procs
+    if memory_gb:
+        plugin_args['memory_gb'] = memory_gb
+    started_at = utc_now()
+    execution_graph = workflow.run(plugin=plugin, plugin_args=plugin_args)
 
-# Create the draw segmentation node
-draw_gm_segmentation_node = Node(DrawSegmentationInterface(), name='draw_gm_segmentation')
-draw_gm_segmentation_node.inputs.title = 'GM@map'
-draw_wm_segmentation_node = Node(DrawSegmentationInterface(), name='draw_wm_segmentation')
-draw_wm_segmentation_node.inputs.title = 'WM@map'
-draw_csf_segmentation_node = Node(DrawSegmentationInterface(), name='draw_csf_segmentation')
-draw_csf_segmentation_node.inputs.title = 'CSF@map'
+    # Report how much of the run was served from the cache
+    reused_nodes, recomputed_nodes = split_cached_nodes(execution_graph, started_at)
+    logger.info(f'Nodes reused from cache: {len(reused_nodes)}, recomputed: {len(recomputed_nodes)}')
 
-# Create the final output node
-final_output_node = Node(OrganizeFinalOutputInterface(), name='final_output')
+    # Report the time, memory and I/O of every stage next to the node cache
+    write_run_report(execution_graph, workflow.base_dir, reused_nodes)
 
-# ==========================================
+    return execution_graph
 
 # ==========================================
-# Connect the nodes
-# ==========================================
-
-# Create a workflow
-workflow = Workflow(name='preprocess_workflow')
-nodes = [
-    process_pair_node,
-    acpc_node,
-    zip_node,
-    orient2std_node,
-    registration_node, 
-    skull_stripping_node,
-    bias_field_correction_node,
-    enhancement_node,
-    segmentation_node,
-    draw_gm_segmentation_node,
-    draw_wm_segmentation_node,
-    draw_csf_segmentation_node,
-    final_output_node,
-]
-workflow.add_nodes(nodes)
-
-# Connect the input_file_node to the acpc_node (input_file & output_folder)
-workflow.connect(process_pair_node, 'input_file', acpc_node, 'input_file')
-workflow.connect(process_pair_node, 'output_folder', acpc_node, 'output_folder')
-
-# Connect the acpc_node to the zip_node (input_file & output_folder)
-workflow.connect(acpc_node, 'output_file', zip_node, 'input_file')
-workflow.connect(process_pair_node, 'output_folder', zip_node, 'output_folder')
-
-# Connect the zip_node to the orient2std_node (input_file & output_folder)
-workflow.connect(zip_node, 'output_file', orient2std_node, 'input_file')
-workflow.connect(process_pair_node, 'output_folder', orient2std_node, 'output_folder')
-
-# Connect the orient2std_node to the registration_node (input_file & output_folder)
-workflow.connect(orient2std_node, 'output_file', registration_node, 'input_file')
-workflow.connect(process_pair_node, 'output_folder', registration_node, 'output_folder')
-
-# Connect the registration_node to the skull_stripping_node (input_file & output_folder)
-workflow.connect(registration_node, 'output_file', skull_stripping_node, 'input_file')
-workflow.connect(process_pair_node, 'output_folder', skull_stripping_node, 'output_folder')
-
-# Connect the skull_stripping_node to the bias_field_correction_node (input_file & output_folder)
-workflow.connect(skull_stripping_node, 'output_file', bias_field_correction_node, 'input_file')
-workflow.connect(process_pair_node, 'output_folder', bias_field_correction_node, 'output_folder')
-
-# Connect the bias_field_correction_node to the enhancement_node (input_file & output_folder)
-workflow.connect(bias_field_correction_node, 'output_file', enhancement_node, 'input_file')
-workflow.connect(process_pair_node, 'output_folder', enhancement_node, 'output_folder')
-
-# Connect the enhancement_node to the segmentation_node (input_file & output_folder)
-workflow.connect(enhancement_node, 'output_file', segmentation_node, 'input_file')
-workflow.connect(process_pair_node, 'output_folder', segmentation_node, 'output_folder')
-
-# Connect acpc_node to draw_gm_segmentation_node (input_file & output_folder)
-workflow.connect(acpc_node, 'output_file', draw_gm_segmentation_node, 'acpc_input_file')
-workflow.connect(segmentation_node, 'gm_segmented_output_file', draw_gm_segmentation_node, 'segmented_input_file')
-workflow.connect(process_pair_node, 'output_folder', draw_gm_segmentation_node, 'output_folder')
-# Connect acpc_node to draw_wm_segmentation_node (input_file & output_folder)
-workflow.connect(acpc_node, 'output_file', draw_wm_segmentation_node, 'acpc_input_file')
-workflow.connect(segmentation_node, 'wm_segmented_output_file', draw_wm_segmentation_node, 'segmented_input_file')
-workflow.connect(process_pair_node, 'output_folder', draw_wm_segmentation_node, 'output_folder')
-# Connect acpc_node to draw_csf_segmentation_node (input_file & output_folder)
-workflow.connect(acpc_node, 'output_file', draw_csf_segmentation_node, 'acpc_input_file')
-workflow.connect(segmentation_node, 'csf_segmented_output_file', draw_csf_segmentation_node, 'segmented_input_file')
-workflow.connect(process_pair_node, 'output_folder', draw_csf_segmentation_node, 'output_folder')
-
-# Connect the process_pair_node to the final_output_node (output_folder)
-workflow.connect(process_pair_node, 'output_folder', final_output_node, 'output_folder')
-# Connect the draw_gm_segmentation_node to the final_output_node (acpc_output_file & acpc_output_png)
-workflow.connect(acpc_node, 'output_file', final_output_node, 'acpc_output_file')
-workflow.connect(acpc_node, 'output_png_file', final_output_node, 'acpc_output_png_file')
-# Connect the draw_gm_segmentation_node to the final_output_node (gm_png_file)
-workflow.connect(draw_gm_segmentation_node, 'output_file', final_output_node, 'gm_png_file')
-# Connect the draw_wm_segmentation_node to the final_output_node (wm_png_file)
-workflow.connect(draw_wm_segmentation_node, 'output_file', final_output_node, 'wm_png_file')
-# Connect the draw_csf_segmentation_node to the final_output_node (csf_png_file)
-workflow.connect(draw_csf_segmentation_node, 'output_file', final_output_node, 'csf_png_file')
-
-# ==========================================
-
-# ==========================================
-# Draw the workflow and run it
-# ==========================================
-
-# Draw the workflow
-workflow.write_graph(graph2use='flat', format='png', simple_form=True)
-
-# Convert the detailed dot file to a png file
-convert_dot_to_png('./graph_detailed.dot', './graph_detailed.png')
 
-# Run the workflow
-workflow.run()
\ No newline at end of file
+if __name__ == '__main__':
+    # Kept for `python workflow.py [options]`, same as `python -m preprocess run [options]`
+    from preprocess.cli import main
+    main(['run'] + sys.argv[1:])